@@ -1,29 +1,23 @@
-from math import sqrt
-from ruckig import InputParameter, Result, Ruckig, Trajectory  # pip install ruckig
-
-
-class State():
-	def __init__(self, v_idx, ang_idx, disc_vels, irr_times, is_final=False):
-		self.v_idx = v_idx
-		self.ang_idx = ang_idx
-		self.v = disc_vels[v_idx]
-		self.vel_square = self.v * self.v
-		if is_final:
-			assert self.v == 0
-			self.half_window = 0
-		else:
-			self.half_window = self.v * irr_times[self.ang_idx] * 0.5
-
-		self.key = str(self.v_idx) + "_" + str(ang_idx)
+import time
+import warnings
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from copy import copy
+from heapq import heappop, heappush
+from math import floor, sqrt
 
-	def __repr__(self):
-		return self.key
+import numpy as np
 
-	def __str__(self):
-		return self.key
+from ATOM_costs import CostBlockPrefetcher, EdgeCostCache, EdgeCostEngine, SurrogateCosts, TransitionLowerBound, feasible_pairs
+from ATOM_trajectory import ArcTrajectory
 
-	def __hash__(self):
-		return hash(self.key)
+# The compiled backend is optional, see atom_native.cpp and the readme for how to build it.
+try:
+	import atom_native
+except ImportError:
+	atom_native = None
 
 
 def linspace(a, b, n):
@@ -34,78 +28,704 @@ def linspace(a, b, n):
 	return [a + i*delta for i in range(n)]
 
 
-def calc_time_between_segments(irr_times, switch_times, angle_distances, max_window, idx, v0, v1, parameters):
-	assert idx > 0
-	idx0 = idx - 1
-	idx1 = idx
-
-	window_size_0 = v0 * irr_times[idx0]
-	window_size_1 = v1 * irr_times[idx1]
-
-	if window_size_0 > max_window or window_size_1 > max_window:
-		return float('inf')
-	remaining_angle = angle_distances[idx0] - (window_size_0+window_size_1)/2
-	assert remaining_angle > 0
-
-	elst = switch_times[idx0]
+def calc_time_between_segments(irr_times, switch_times, angle_distances, max_window, idx, v0, v1, parameters, stats=None):
+	# Convenience function for single edges. atom() keeps one EdgeCostEngine alive for the whole search instead.
+	return EdgeCostEngine(irr_times, switch_times, angle_distances, max_window, parameters, stats=stats).cost(idx, v0, v1)
+
+
+def window_limited_vel_idx(disc_vels, irr_time, max_window):
+	# Returns the number of discrete velocities v for which the window v * irr_time does not exceed max_window.
+	if irr_time <= 0:
+		return len(disc_vels)
+	end = bisect_right(disc_vels, max_window / irr_time)
+	# Make sure that the result agrees exactly with the check in calc_time_between_segments.
+	while end > 0 and disc_vels[end - 1] * irr_time > max_window:
+		end -= 1
+	while end < len(disc_vels) and disc_vels[end] * irr_time <= max_window:
+		end += 1
+	return end
+
+
+def unvisited_in_range(unvisited, lo, hi):
+	# unvisited is a bitset for one layer, where bit v_idx is set if that state has not been expanded yet.
+	if hi <= lo:
+		return []
+	bits = (unvisited >> lo) & ((1 << (hi - lo)) - 1)
+	v_idxs = []
+	while bits:
+		lowest = bits & -bits
+		v_idxs.append(lo + lowest.bit_length() - 1)
+		bits ^= lowest
+	return v_idxs
+
+
+def unvisited_predecessors(unvisited, succ_lo, succ_hi, begin, v_idx):
+	# States of the previous layer whose reachable velocity range [succ_lo, succ_hi) contains v_idx, and whose bit is
+	# set in the bitset unvisited. The range arrays start at velocity index begin.
+	candidates = begin + np.flatnonzero((succ_lo <= v_idx) & (succ_hi > v_idx))
+	return [u for u in candidates.tolist() if (unvisited >> u) & 1]
+
+
+def push_open(open_heap, f, cell, vel_res):
+	# Ties in f are broken in favour of the higher velocity, and then the later angle.
+	heappush(open_heap, (f, -(cell % vel_res), -cell))
+
+
+def pop_open(open_heap, f_score, has_been_visited):
+	# Lazy deletion: entries that have been superseded by a better f-score, or whose state has already been expanded, are skipped.
+	while len(open_heap) > 0:
+		f, _, neg_cell = heappop(open_heap)
+		cell = -neg_cell
+		if not has_been_visited[cell] and f == f_score[cell]:
+			return cell
+	return -1
+
+
+def peek_open(open_heap, f_score, has_been_visited):
+	# The smallest valid f-score in the open set, or infinity if it is empty. Stale entries on top are removed.
+	while len(open_heap) > 0:
+		f, _, neg_cell = open_heap[0]
+		if not has_been_visited[-neg_cell] and f == f_score[-neg_cell]:
+			return f
+		heappop(open_heap)
+	return float('inf')
+
+
+class SearchProblem():
+	"""
+	The discretised ATOM search graph.
+
+	Layer ang_idx contains the states with the velocities disc_vels[vel_idx_begin[ang_idx]:vel_idx_end[ang_idx]], where
+	the end index is chosen such that the windows are small enough. vel_bounds can further restrict the velocities of
+	each layer to an interval (v_min, v_max). The first and the last layer only contain v = 0. Finally, the velocities
+	that cannot be reached from the first layer, or from which the gantry cannot stop at the last layer, are removed
+	(restrict_to_envelope()).
+
+	With workers, the edge costs are computed as whole blocks per layer transition in a process pool (cost_blocks),
+	and close() has to be called when the search is done.
+
+	heuristic selects the A* heuristic, see astar_heuristic(). stats is an optional ATOM_costs.SearchStats to fill in.
+	cost_table is an optional ATOM_cost_table.EdgeCostTable to look the edge costs up in.
+	"""
+	def __init__(self, irr_times, elsts, angle_distances, maximum_window_size, parameters, vel_res, cache=None, workers=None, chunksize=1, vel_bounds=None, heuristic="relaxed", stats=None, cost_table=None):
+		self.n = len(irr_times)
+		self.irr_times = irr_times
+		self.elsts = elsts
+		self.angle_distances = angle_distances
+		self.maximum_window_size = maximum_window_size
+		self.parameters = parameters
+		self.vel_res = vel_res
+		self.heuristic = heuristic
+		self.stats = stats
+		self.disc_vels = linspace(0, parameters["v_max"], vel_res)
+		assert cost_table is None or workers is None, "The worker processes do not use the cost table"
+		self.edge_costs = EdgeCostEngine(irr_times, elsts, angle_distances, maximum_window_size, parameters, cache, stats, cost_table)
+
+		# States with a window larger than the maximum window size can never be part of a feasible trajectory.
+		n = self.n
+		self.vel_idx_end = [1] + [window_limited_vel_idx(self.disc_vels, irr_times[ang_idx], maximum_window_size) for ang_idx in range(1, n - 1)] + [1]
+		self.vel_idx_begin = [0] * n
+		if vel_bounds is not None:
+			assert len(vel_bounds) == n
+			for ang_idx in range(1, n - 1):
+				v_min, v_max = vel_bounds[ang_idx]
+				self.vel_idx_begin[ang_idx] = bisect_left(self.disc_vels, v_min)
+				self.vel_idx_end[ang_idx] = min(self.vel_idx_end[ang_idx], bisect_right(self.disc_vels, v_max))
+		self.allowed_vel_idx_begin = list(self.vel_idx_begin)
+		self.allowed_vel_idx_end = list(self.vel_idx_end)
+		self.restrict_to_envelope()
+		self.heuristics = {}
+
+		self.cost_blocks = None
+		if workers is not None:
+			self.cost_blocks = CostBlockPrefetcher(irr_times, elsts, angle_distances, maximum_window_size, parameters, self.disc_vels, self.vel_idx_begin, self.vel_idx_end, workers, chunksize)
+
+	def close(self):
+		if self.cost_blocks is not None:
+			self.cost_blocks.close()
+
+	def for_parameters(self, parameters, cache=None, stats=None, cost_table=None):
+		"""
+		The same problem with another j_max: the velocity grid, the windows and the reachability envelope only depend on
+		v_max, a_max and a_min, so they are shared, and only the edge costs are new. So is the "switching" heuristic.
+		"""
+		assert self.cost_blocks is None, "The worker processes use the parameters of this problem"
+		assert all(parameters[key] == self.parameters[key] for key in ("v_max", "a_max", "a_min")), "Only j_max can differ"
+		problem = copy(self)
+		problem.parameters = parameters
+		problem.stats = stats
+		problem.edge_costs = EdgeCostEngine(self.irr_times, self.elsts, self.angle_distances, self.maximum_window_size, parameters, cache, stats, cost_table)
+		problem.heuristics = dict(self.heuristics) if self.heuristic == "switching" else {}
+		return problem
+
+	def neigh_vel_range(self, ang_idx, v):
+		# Velocity indices [lo, hi) in layer ang_idx + 1 that are reachable from v in layer ang_idx under the acceleration limits.
+		half_window = v * self.irr_times[ang_idx] * 0.5
+		angle_dist_between_center_points = self.angle_distances[ang_idx]
+		local_max_vel = sqrt(2 * self.parameters["a_max"] * (angle_dist_between_center_points - half_window) + v * v)
+		local_min_vel = 0 if 2 * self.parameters["a_min"] * (angle_dist_between_center_points - half_window) + v * v < 0 else sqrt(2 * self.parameters["a_min"] * (angle_dist_between_center_points - half_window) + v * v)
+
+		lo = max(bisect_left(self.disc_vels, local_min_vel), self.vel_idx_begin[ang_idx + 1])
+		hi = min(bisect_right(self.disc_vels, local_max_vel), self.vel_idx_end[ang_idx + 1])
+		return lo, hi
+
+	def restrict_to_envelope(self):
+		# Removes the states that cannot be on any trajectory, because neigh_vel_range() never reaches them from the first
+		# layer (forward), or never leads from them to v = 0 in the last layer (backward). The optimum does not change,
+		# but fewer states are expanded and fewer edges evaluated, and the cost blocks only cover the remaining states.
+		# The per cell arrays of the searches and the heuristic still have n * vel_res entries, so they do not shrink.
+		begin = self.vel_idx_begin
+		end = self.vel_idx_end
+		disc_vels = self.disc_vels
+		for ang_idx in range(self.n - 1):
+			if end[ang_idx] <= begin[ang_idx]:
+				end[ang_idx + 1] = begin[ang_idx + 1]
+				continue
+			# The lowest reachable velocity increases with v, and the highest is largest at either end of the layer.
+			lo, hi = self.neigh_vel_range(ang_idx, disc_vels[begin[ang_idx]])
+			hi = max(hi, self.neigh_vel_range(ang_idx, disc_vels[end[ang_idx] - 1])[1])
+			begin[ang_idx + 1] = lo
+			end[ang_idx + 1] = max(hi, lo)
+		for ang_idx in range(self.n - 2, 0, -1):
+			# Bisection for the first velocity from which no state of the next layer is reachable.
+			lo, hi = begin[ang_idx], end[ang_idx]
+			while lo < hi:
+				mid = (lo + hi) // 2
+				neigh_lo, neigh_hi = self.neigh_vel_range(ang_idx, disc_vels[mid])
+				if neigh_lo < end[ang_idx + 1]:
+					lo = mid + 1
+				else:
+					hi = mid
+			end[ang_idx] = max(lo, begin[ang_idx])
+
+	def count_pruned(self, neigh_ang_idx, reachable):
+		# Counts the candidate edges of one expansion into layer neigh_ang_idx that are not evaluated, given the number of
+		# states there that can be reached. States outside the reachability envelope count as kinematically rejected.
+		layer_size = 1 if neigh_ang_idx in (0, self.n - 1) else self.vel_res
+		allowed = max(self.allowed_vel_idx_end[neigh_ang_idx] - self.allowed_vel_idx_begin[neigh_ang_idx], 0)
+		self.stats.window_rejected += layer_size - allowed
+		self.stats.kinematic_rejected += allowed - reachable
+
+	def velocity_profile(self, v_idxs):
+		return velocity_profile(v_idxs, self.parameters["v_max"], self.vel_res)
+
+
+def velocity_profile(v_idxs, v_max, vel_res):
+	# v_idxs are the velocity indices of the optimal path, from the first to the last layer.
+	return [v_max * v_idx / (vel_res - 1) for v_idx in v_idxs]
+
+
+def astar_heuristic(problem, reverse=False, deadline=None):
+	"""
+	Lower bounds on the remaining time from every state to the end of the arc, as an array indexed by cell. With
+	reverse, lower bounds on the time from the start of the arc to every state instead, for the backward search.
+
+	"switching" only adds up the remaining irradiation and energy layer switching times. "relaxed" (the default) is the
+	exact remaining time of the same graph when every edge cost is replaced by a lower bound (see
+	ATOM_costs.TransitionLowerBound), computed by a sweep over the layers. Both heuristics are consistent, so A* still
+	finds the optimum. A heuristic that is already in problem.heuristics (see relaxed_heuristics()) is used as it is.
+
+	If the sweep passes the perf_counter() time deadline, the layers that it did not reach get the "switching" heuristic
+	up to the last layer it did, plus the smallest relaxed bound there, which is still consistent.
+	"""
+	assert problem.heuristic in ("switching", "relaxed"), "Unknown heuristic " + str(problem.heuristic)
+	if reverse in problem.heuristics:
+		return problem.heuristics[reverse]
+	if problem.heuristic == "switching":
+		h = np.zeros(problem.n)
+		per_layer = np.asarray(problem.irr_times[:-1]) + problem.elsts
+		if reverse:
+			h[1:] = np.cumsum(per_layer)
+		else:
+			h[:-1] = np.cumsum(per_layer[::-1])[::-1]
+		return array('d', np.repeat(h, problem.vel_res).tobytes())
+	return relaxed_heuristics([problem], reverse, deadline)[0]
+
+
+def relaxed_heuristics(problems, reverse=False, deadline=None):
+	"""
+	The "relaxed" heuristics of astar_heuristic() for problems that only differ in j_max (see
+	SearchProblem.for_parameters()), in one sweep: the feasible velocity pairs of every layer transition and their
+	acceleration limited bounds are the same for all of them, and only the jerk limited part is computed per problem.
+	"""
+	problem = problems[0]
+	n = problem.n
+	vel_res = problem.vel_res
+	irr_times = problem.irr_times
+	elsts = problem.elsts
+	per_layer = np.asarray(irr_times[:-1]) + elsts
+	lower_bounds = [TransitionLowerBound(other.parameters) for other in problems]
+	disc_vels = np.asarray(problem.disc_vels)
+	hs = [np.full((n, vel_res), float('inf')) for _ in problems]
+	for h in hs:
+		if reverse:
+			h[0, 0] = 0.0
+		else:
+			h[n - 1, 0] = 0.0
+	for idx in (range(1, n) if reverse else range(n - 1, 0, -1)):
+		if deadline is not None and time.perf_counter() > deadline:
+			# Layer idx (reverse) or idx - 1 (forward) and the ones after it in the sweep are not done.
+			for h in hs:
+				if reverse:
+					h[idx:] = (np.min(h[idx - 1]) + np.cumsum(per_layer[idx - 1:]))[:, None]
+				else:
+					h[:idx] = (np.min(h[idx]) + np.cumsum(per_layer[:idx][::-1])[::-1])[:, None]
+			break
+		begin_0, end_0 = problem.vel_idx_begin[idx - 1], problem.vel_idx_end[idx - 1]
+		begin_1, end_1 = problem.vel_idx_begin[idx], problem.vel_idx_end[idx]
+		v0s = disc_vels[begin_0:end_0]
+		v1s = disc_vels[begin_1:end_1]
+		if v0s.size == 0 or v1s.size == 0:
+			continue
+		# The bounds are finite exactly where the acceleration limited ones are, so the feasible pairs are the same for
+		# all problems.
+		feasible = feasible_pairs(v0s, v1s, irr_times[idx - 1], irr_times[idx], problem.angle_distances[idx - 1], problem.maximum_window_size, problem.parameters)
+		if reverse:
+			feasible &= np.isfinite(hs[0][idx - 1, begin_0:end_0])[:, None]
+		else:
+			feasible &= np.isfinite(hs[0][idx, begin_1:end_1])[None, :]
+		i, j = np.nonzero(feasible)
+		remaining_angles = problem.angle_distances[idx - 1] - (v0s[i] * irr_times[idx - 1] + v1s[j] * irr_times[idx]) / 2
+		bound = lower_bounds[0].acceleration_bound(v0s[i], v1s[j], remaining_angles, elsts[idx - 1])
+		for lower_bound, h in zip(lower_bounds, hs):
+			costs = irr_times[idx - 1] + lower_bound.durations(v0s[i], v1s[j], remaining_angles, elsts[idx - 1], bound=bound)
+			totals = np.full(feasible.shape, float('inf'))
+			if reverse:
+				totals[i, j] = h[idx - 1, begin_0 + i] + costs
+				h[idx, begin_1:end_1] = totals.min(axis=0)
+			else:
+				totals[i, j] = costs + h[idx, begin_1 + j]
+				h[idx - 1, begin_0:end_0] = totals.min(axis=1)
+	return [array('d', h.tobytes()) for h in hs]
+
+
+def solve_astar(problem):
+	n = problem.n
+	vel_res = problem.vel_res
+	disc_vels = problem.disc_vels
+	irr_times = problem.irr_times
+	edge_costs = problem.edge_costs
+	cost_blocks = problem.cost_blocks
+	vel_idx_begin = problem.vel_idx_begin
+	stats = problem.stats
+	t0 = time.perf_counter()
+	heuristic = astar_heuristic(problem)
+	t1 = time.perf_counter()
+
+	# The state with velocity index v_idx in layer ang_idx is identified by the cell ang_idx * vel_res + v_idx.
+	# The first and the last layer only use their v = 0 cell.
+	num_cells = n * vel_res
+	initial_cell = 0
+	final_cell = (n - 1) * vel_res
+	g_score = array('d', [float('inf')]) * num_cells
+	f_score = array('d', [float('inf')]) * num_cells
+	came_from = array('q', [-1]) * num_cells
+	has_been_visited = bytearray(num_cells)
+	unvisited = [1] + [(1 << vel_res) - 1] * (n - 2) + [1]
+
+	g_score[initial_cell] = 0
+	f_score[initial_cell] = heuristic[initial_cell]
+
+	open_heap = []
+	push_open(open_heap, f_score[initial_cell], initial_cell, vel_res)
 
-	otg = Ruckig(1)
-	inp = InputParameter(1)
-	trajectory = Trajectory(1)
+	found_it = False
+	while True:
+		current = pop_open(open_heap, f_score, has_been_visited)
+		if current == -1:
+			break
+		has_been_visited[current] = True
+		if current == final_cell:
+			assert heuristic[final_cell] == 0
+			found_it = True
+			break
 
-	inp.current_position = [0.0]
-	inp.current_velocity = [v0]
-	inp.current_acceleration = [0.0]
-	
-	inp.target_velocity = [v1]
-	inp.target_position = [remaining_angle]
-	inp.target_acceleration = [0.0]
-	
-	inp.max_velocity = [parameters["v_max"]]
-	inp.max_acceleration = [parameters["a_max"]]
-	inp.max_jerk = [parameters["j_max"]]
+		current_ang_idx, current_v_idx = divmod(current, vel_res)
+		unvisited[current_ang_idx] &= ~(1 << current_v_idx)
+		current_g_score = g_score[current]
+		current_v = disc_vels[current_v_idx]
+
+		# Only the velocities that are reachable under the acceleration limits, and whose window is small enough, are considered.
+		neigh_ang_idx = current_ang_idx + 1
+		lo, hi = problem.neigh_vel_range(current_ang_idx, current_v)
+		neighs = unvisited_in_range(unvisited[neigh_ang_idx], lo, hi)
+		if stats is not None:
+			stats.count_expansions()
+			stats.edges_evaluated += len(neighs)
+			problem.count_pruned(neigh_ang_idx, max(hi - lo, 0))
+
+		first_neigh_cell = neigh_ang_idx * vel_res
+		block_row = None
+		if cost_blocks is not None and len(neighs) > 0:
+			block_row = cost_blocks.block(neigh_ang_idx)[current_v_idx - vel_idx_begin[current_ang_idx]].tolist()
+			neigh_v_idx_offset = vel_idx_begin[neigh_ang_idx]
+		for neigh_v_idx in neighs:
+			d = edge_costs.cost(neigh_ang_idx, current_v, disc_vels[neigh_v_idx]) if block_row is None else block_row[neigh_v_idx - neigh_v_idx_offset]
+			if d != float('inf'):
+				tentative_g_score = current_g_score + d
+				neigh = first_neigh_cell + neigh_v_idx
+				if tentative_g_score <= g_score[neigh]:
+					came_from[neigh] = current
+					g_score[neigh] = tentative_g_score
+					f_score[neigh] = tentative_g_score + heuristic[neigh]
+					push_open(open_heap, f_score[neigh], neigh, vel_res)
+
+	t2 = time.perf_counter()
+	if not found_it:
+		time_val, traj = float('inf'), None
+	else:
+		time_val = g_score[current] + irr_times[-1]
+		v_idxs = [current % vel_res]
+		while came_from[current] != -1:
+			current = came_from[current]
+			v_idxs.append(current % vel_res)
+		traj = problem.velocity_profile(list(reversed(v_idxs)))
+	if stats is not None:
+		add_phase_times(stats, t0, t1, t2, time.perf_counter())
+	return time_val, traj
 
-	inp.min_velocity = [-1.0e-16]  # This would be 0, but there are some rounding errors that cause issues, it seems.
-	inp.min_acceleration = [parameters["a_min"]]
 
-	inp.minimum_duration = elst
-	if not otg.validate_input(inp, check_current_state_within_limits=True, check_target_state_within_limits=True):
-		return float('inf')
+def solve_dp(problem):
+	"""
+	Forward dynamic programming over the layers. The edges only go from one layer to the next, so sweeping the layers in
+	order and taking, for each state, the minimum over all predecessors gives the same optimum as A*, without any
+	priority queue. Only the g-scores of the current layer and a compact predecessor array are kept.
+	"""
+	n = problem.n
+	vel_res = problem.vel_res
+	disc_vels = np.asarray(problem.disc_vels)
+	edge_costs = problem.edge_costs
+	stats = problem.stats
+	t0 = time.perf_counter()
+
+	pred = np.zeros((n, vel_res), dtype=np.int32)
+	g = np.zeros(1)
+	g_v_idxs = np.zeros(1, dtype=np.int32)  # The velocity indices with a finite g-score in the current layer.
+	for ang_idx in range(1, n):
+		begin = problem.vel_idx_begin[ang_idx]
+		end = problem.vel_idx_end[ang_idx]
+		if begin >= end:
+			break
+		if stats is not None:
+			stats.count_expansions(len(g_v_idxs))
+			stats.window_rejected += len(g_v_idxs) * ((1 if ang_idx == n - 1 else vel_res) - (end - begin))
+		if problem.cost_blocks is None:
+			costs = edge_costs.batch(ang_idx, disc_vels[g_v_idxs], disc_vels[begin:end])
+		else:
+			costs = problem.cost_blocks.block(ang_idx)[g_v_idxs - problem.vel_idx_begin[ang_idx - 1]]
+			problem.cost_blocks.release(ang_idx)
+		total = g[:, None] + costs
+		best = np.argmin(total, axis=0)
+		g_next = total[best, np.arange(end - begin)]
+		pred[ang_idx, begin:end] = g_v_idxs[best]
+
+		finite = np.isfinite(g_next)
+		g_v_idxs = (begin + np.nonzero(finite)[0]).astype(np.int32)
+		g = g_next[finite]
+		if len(g) == 0:
+			break
 
-	# Calculate the trajectory in an offline manner
-	try:
-		result = otg.calculate(inp, trajectory)
-	except RuntimeError:
-		return float('inf')
-	if result == Result.ErrorInvalidInput:
-		return float('inf')
+	t1 = time.perf_counter()
+	if ang_idx < n - 1 or len(g) == 0:
+		time_val, traj = float('inf'), None
+	else:
+		time_val = float(g[0]) + problem.irr_times[-1]
+		v_idxs = [0]
+		for ang_idx in range(n - 1, 0, -1):
+			v_idxs.append(int(pred[ang_idx, v_idxs[-1]]))
+		traj = problem.velocity_profile(list(reversed(v_idxs)))
+	if stats is not None:
+		add_phase_times(stats, t0, t0, t1, time.perf_counter())
+	return time_val, traj
 
-	return trajectory.duration + irr_times[idx0]
 
+def solve_bidirectional(problem):
+	"""
+	A* from both stationary end points at once. The forward search starts in the first layer, and the backward search
+	starts in the last layer and follows the edges in reverse, with lower bounds on the time from the start as heuristic.
+	Every step expands a state of the side with the smaller open set. Whenever an edge reaches a state that the other
+	side has reached too, the path through it is a candidate, and the search stops once the best candidate is no longer
+	than the smallest f-score of either side, which bounds every path that has not been found yet.
+	"""
+	n = problem.n
+	vel_res = problem.vel_res
+	disc_vels = problem.disc_vels
+	irr_times = problem.irr_times
+	edge_costs = problem.edge_costs
+	cost_blocks = problem.cost_blocks
+	vel_idx_begin = problem.vel_idx_begin
+	stats = problem.stats
+	t0 = time.perf_counter()
+	heuristics = (astar_heuristic(problem), astar_heuristic(problem, reverse=True))
+	t1 = time.perf_counter()
+
+	# Index 0 belongs to the forward search, index 1 to the backward search, where came_from holds the successors.
+	num_cells = n * vel_res
+	initial_cell = 0
+	final_cell = (n - 1) * vel_res
+	g_scores = (array('d', [float('inf')]) * num_cells, array('d', [float('inf')]) * num_cells)
+	f_scores = (array('d', [float('inf')]) * num_cells, array('d', [float('inf')]) * num_cells)
+	came_from = (array('q', [-1]) * num_cells, array('q', [-1]) * num_cells)
+	has_been_visited = (bytearray(num_cells), bytearray(num_cells))
+	unvisited = ([1] + [(1 << vel_res) - 1] * (n - 2) + [1], [1] + [(1 << vel_res) - 1] * (n - 2) + [1])
+	open_heaps = ([], [])
+	for side, cell in ((0, initial_cell), (1, final_cell)):
+		g_scores[side][cell] = 0
+		f_scores[side][cell] = heuristics[side][cell]
+		push_open(open_heaps[side], f_scores[side][cell], cell, vel_res)
+
+	# The reachable velocity ranges of the states of every layer, which the backward search needs to find predecessors.
+	succ_lo = []
+	succ_hi = []
+	for ang_idx in range(n - 1):
+		ranges = [problem.neigh_vel_range(ang_idx, disc_vels[v_idx]) for v_idx in range(vel_idx_begin[ang_idx], problem.vel_idx_end[ang_idx])]
+		succ_lo.append(np.array([lo for lo, _ in ranges], dtype=np.int64))
+		succ_hi.append(np.array([hi for _, hi in ranges], dtype=np.int64))
+
+	best = float('inf')
+	meet = -1
+	while best > max(peek_open(open_heaps[0], f_scores[0], has_been_visited[0]), peek_open(open_heaps[1], f_scores[1], has_been_visited[1])):
+		side = 0 if len(open_heaps[0]) <= len(open_heaps[1]) else 1
+		g_score = g_scores[side]
+		current = pop_open(open_heaps[side], f_scores[side], has_been_visited[side])
+		has_been_visited[side][current] = True
+		current_ang_idx, current_v_idx = divmod(current, vel_res)
+		unvisited[side][current_ang_idx] &= ~(1 << current_v_idx)
+		current_g_score = g_score[current]
+		current_v = disc_vels[current_v_idx]
+
+		if side == 0:
+			if current_ang_idx == n - 1:
+				continue
+			neigh_ang_idx = current_ang_idx + 1
+			lo, hi = problem.neigh_vel_range(current_ang_idx, current_v)
+			neighs = unvisited_in_range(unvisited[0][neigh_ang_idx], lo, hi)
+		else:
+			if current_ang_idx == 0:
+				continue
+			neigh_ang_idx = current_ang_idx - 1
+			neighs = unvisited_predecessors(unvisited[1][neigh_ang_idx], succ_lo[neigh_ang_idx], succ_hi[neigh_ang_idx], vel_idx_begin[neigh_ang_idx], current_v_idx)
+			if stats is not None:
+				lo, hi = 0, int(np.count_nonzero((succ_lo[neigh_ang_idx] <= current_v_idx) & (succ_hi[neigh_ang_idx] > current_v_idx)))
+		if stats is not None:
+			stats.count_expansions()
+			stats.edges_evaluated += len(neighs)
+			problem.count_pruned(neigh_ang_idx, max(hi - lo, 0))
+
+		block_line = None
+		if cost_blocks is not None and len(neighs) > 0:
+			if side == 0:
+				block_line = cost_blocks.block(neigh_ang_idx)[current_v_idx - vel_idx_begin[current_ang_idx]].tolist()
+			else:
+				block_line = cost_blocks.block(current_ang_idx)[:, current_v_idx - vel_idx_begin[current_ang_idx]].tolist()
+			neigh_v_idx_offset = vel_idx_begin[neigh_ang_idx]
+		first_neigh_cell = neigh_ang_idx * vel_res
+		for neigh_v_idx in neighs:
+			if block_line is not None:
+				d = block_line[neigh_v_idx - neigh_v_idx_offset]
+			elif side == 0:
+				d = edge_costs.cost(neigh_ang_idx, current_v, disc_vels[neigh_v_idx])
+			else:
+				d = edge_costs.cost(current_ang_idx, disc_vels[neigh_v_idx], current_v)
+			if d != float('inf'):
+				tentative_g_score = current_g_score + d
+				neigh = first_neigh_cell + neigh_v_idx
+				if tentative_g_score <= g_score[neigh]:
+					came_from[side][neigh] = current
+					g_score[neigh] = tentative_g_score
+					if tentative_g_score + g_scores[1 - side][neigh] < best:
+						best = tentative_g_score + g_scores[1 - side][neigh]
+						meet = neigh
+					# States that the other side has expanded already have an optimal completion, and states whose f-score
+					# can not beat the best path are not needed either.
+					f_scores[side][neigh] = tentative_g_score + heuristics[side][neigh]
+					if not has_been_visited[1 - side][neigh] and f_scores[side][neigh] < best:
+						push_open(open_heaps[side], f_scores[side][neigh], neigh, vel_res)
+
+	t2 = time.perf_counter()
+	if meet == -1:
+		time_val, traj = float('inf'), None
+	else:
+		v_idxs = []
+		current = meet
+		while current != -1:
+			v_idxs.append(current % vel_res)
+			current = came_from[0][current]
+		v_idxs.reverse()
+		current = came_from[1][meet]
+		while current != -1:
+			v_idxs.append(current % vel_res)
+			current = came_from[1][current]
+		time_val, traj = best + irr_times[-1], problem.velocity_profile(v_idxs)
+	if stats is not None:
+		add_phase_times(stats, t0, t1, t2, time.perf_counter())
+	return time_val, traj
 
-def get_neighs(all_states, current, has_been_visited):
-	# TODO: This is a disgrace. Make it faster.
-	return list(filter(lambda el: not has_been_visited[current.ang_idx+1][all_states[current.ang_idx+1].index(el)], all_states[current.ang_idx+1]))
 
+def surrogate_problem(irr_times, elsts, angle_distances, maximum_window_size, parameters, vel_res, bound, precompute=False):
+	# A SearchProblem with the costs of ATOM_costs.SurrogateCosts, for solve_dp(). precompute evaluates all of them at
+	# once, which is faster on small grids.
+	problem = SearchProblem(irr_times, elsts, angle_distances, maximum_window_size, parameters, vel_res)
+	problem.edge_costs = SurrogateCosts(irr_times, elsts, angle_distances, maximum_window_size, parameters, bound)
+	if precompute:
+		problem.edge_costs.precompute(problem.disc_vels)
+	return problem
+
+
+def surrogate_trajectory(problem, coarse_vel_res=24, band=2):
+	"""
+	A good trajectory in a fraction of the time of the search, for the first incumbent of solve_anytime() and for
+	ATOM_estimate.atom_estimate(): the optimum on a grid of coarse_vel_res velocities with the cheap costs of
+	ATOM_costs.SurrogateCosts, refined by dynamic programming with the edge costs of problem over the velocities within
+	band steps of it. The surrogate costs only estimate the feasibility, which the refinement repairs. Returns (velocity
+	indices, cost without the irradiation time of the last layer), or None if no trajectory is found.
+	"""
+	coarse = surrogate_problem(problem.irr_times, problem.elsts, problem.angle_distances, problem.maximum_window_size, problem.parameters, min(coarse_vel_res, problem.vel_res), False, precompute=True)
+	_, vels = solve(coarse, "dp")
+	if vels is None:
+		return None
+	step = problem.parameters["v_max"] / (problem.vel_res - 1)
+	disc_vels = np.asarray(problem.disc_vels)
+	g = np.zeros(1)
+	layers = [np.zeros(1, dtype=int)]  # The velocity indices with a finite cost in each layer.
+	preds = []  # The positions of their predecessors in the previous layer.
+	for ang_idx in range(1, problem.n):
+		center = floor(vels[ang_idx] / step + 1.0e-9)
+		v_idxs = np.arange(max(center - band, problem.vel_idx_begin[ang_idx]), min(center + band + 1, problem.vel_idx_end[ang_idx]))
+		total = g[:, None] + problem.edge_costs.batch(ang_idx, disc_vels[layers[-1]], disc_vels[v_idxs])
+		best = np.argmin(total, axis=0)
+		g = total[best, np.arange(len(v_idxs))]
+		finite = np.isfinite(g)
+		if not np.any(finite):
+			return None
+		layers.append(v_idxs[finite])
+		preds.append(best[finite])
+		g = g[finite]
+	position = int(np.argmin(g))
+	cost = float(g[position])
+	v_idxs = [int(layers[-1][position])]
+	for layer, pred in zip(reversed(layers[:-1]), reversed(preds)):
+		position = int(pred[position])
+		v_idxs.append(int(layer[position]))
+	return list(reversed(v_idxs)), cost
+
+
+def solve_anytime(problem, weight, deadline=None, max_expansions=None, heuristic_deadline=None, initial=None):
+	"""
+	Anytime weighted A* (Hansen and Zhou): states are expanded in the order of g + weight * h, which finds a first
+	trajectory quickly, and the search then continues with the states that can still improve on it, i.e. g + h below the
+	delivery time of the incumbent. States are reopened when a shorter path to them is found. If the open set runs empty,
+	the incumbent is optimal. initial is an optional first incumbent, as returned by surrogate_trajectory().
+
+	The search stops early after the perf_counter() time deadline, or max_expansions expansions, and the relaxed
+	heuristic is cut short at heuristic_deadline (see astar_heuristic()). Returns (delivery time, velocities, lower
+	bound, expansions, incumbents), where the lower bound is the smallest g + h in the open set, and incumbents lists
+	(perf_counter() time, delivery time) of every improvement. The delivery time is infinite and the velocities None if
+	no trajectory has been found.
+	"""
+	n = problem.n
+	vel_res = problem.vel_res
+	disc_vels = problem.disc_vels
+	edge_costs = problem.edge_costs
+	stats = problem.stats
+	incumbent = float('inf')
+	incumbents = []
+	initial_v_idxs = None
+	if initial is not None:
+		initial_v_idxs, incumbent = initial
+		incumbents.append((time.perf_counter(), incumbent + problem.irr_times[-1]))
+	heuristic = astar_heuristic(problem, deadline=heuristic_deadline)
+
+	num_cells = n * vel_res
+	final_cell = (n - 1) * vel_res
+	g_score = array('d', [float('inf')]) * num_cells
+	f_score = array('d', [float('inf')]) * num_cells
+	came_from = array('q', [-1]) * num_cells
+	has_been_visited = bytearray(num_cells)
+	# Edge costs by current cell * vel_res + neighbour velocity index, since reopened states are expanded again.
+	known_costs = {}
+
+	g_score[0] = 0
+	f_score[0] = weight * heuristic[0]
+	open_heap = []
+	push_open(open_heap, f_score[0], 0, vel_res)
+
+	expansions = 0
+	# Whether the incumbent was found by the search, or is still the initial one.
+	found = False
+	while True:
+		if max_expansions is not None and expansions >= max_expansions:
+			break
+		if deadline is not None and time.perf_counter() > deadline:
+			break
+		current = pop_open(open_heap, f_score, has_been_visited)
+		if current == -1:
+			break
+		has_been_visited[current] = True
+		current_g_score = g_score[current]
+		if current_g_score + heuristic[current] >= incumbent:
+			continue
+		expansions += 1
+
+		current_ang_idx, current_v_idx = divmod(current, vel_res)
+		current_v = disc_vels[current_v_idx]
+		neigh_ang_idx = current_ang_idx + 1
+		lo, hi = problem.neigh_vel_range(current_ang_idx, current_v)
+		if stats is not None:
+			stats.count_expansions()
+			stats.edges_evaluated += max(hi - lo, 0)
+			problem.count_pruned(neigh_ang_idx, max(hi - lo, 0))
+
+		first_neigh_cell = neigh_ang_idx * vel_res
+		for neigh_v_idx in range(lo, hi):
+			key = current * vel_res + neigh_v_idx
+			d = known_costs.get(key)
+			if d is None:
+				d = edge_costs.cost(neigh_ang_idx, current_v, disc_vels[neigh_v_idx])
+				known_costs[key] = d
+			tentative_g_score = current_g_score + d
+			neigh = first_neigh_cell + neigh_v_idx
+			if tentative_g_score >= g_score[neigh] or tentative_g_score + heuristic[neigh] >= incumbent:
+				continue
+			came_from[neigh] = current
+			g_score[neigh] = tentative_g_score
+			if neigh == final_cell:
+				incumbent = tentative_g_score
+				found = True
+				incumbents.append((time.perf_counter(), incumbent + problem.irr_times[-1]))
+				continue
+			has_been_visited[neigh] = False
+			f_score[neigh] = tentative_g_score + weight * heuristic[neigh]
+			push_open(open_heap, f_score[neigh], neigh, vel_res)
+
+	# Some state of an optimal path is in the open set with its optimal g, unless the incumbent is optimal.
+	lower_bound = incumbent
+	for f, _, neg_cell in open_heap:
+		cell = -neg_cell
+		if not has_been_visited[cell] and f == f_score[cell]:
+			lower_bound = min(lower_bound, g_score[cell] + heuristic[cell])
+	lower_bound += problem.irr_times[-1]
+
+	if incumbent == float('inf'):
+		return float('inf'), None, lower_bound, expansions, incumbents
+	if not found:
+		return incumbent + problem.irr_times[-1], problem.velocity_profile(initial_v_idxs), lower_bound, expansions, incumbents
+	current = final_cell
+	v_idxs = [0]
+	while came_from[current] != -1:
+		current = came_from[current]
+		v_idxs.append(current % vel_res)
+	return incumbent + problem.irr_times[-1], problem.velocity_profile(list(reversed(v_idxs))), lower_bound, expansions, incumbents
 
-def find_current(open_set, f_score):
-	# TODO: This might be too slow. Use a more clever data structure. A fibonacci heap, probably. 
-	best_state = None
-	best_f_score = float('inf')
-	for state in open_set:
-		if f_score[state.ang_idx][state.v_idx] < best_f_score:
-			best_f_score = f_score[state.ang_idx][state.v_idx]
-			best_state = state
-		elif f_score[state.ang_idx][state.v_idx] == best_f_score:
-			if state.v > best_state.v:
-				best_f_score = f_score[state.ang_idx][state.v_idx]
-				best_state = state
 
-	assert best_f_score < float('inf')
-	return best_state
+def add_phase_times(stats, t_start, t_heuristic, t_search, t_path):
+	# The phases are timed from t_start to t_heuristic, to t_search, and to t_path.
+	stats.seconds["heuristic"] += t_heuristic - t_start
+	stats.seconds["search"] += t_search - t_heuristic
+	stats.seconds["path"] += t_path - t_search
 
 
-def atom(irr_times, elsts, angle_distances, maximum_window_size, parameters, vel_res=256):
+def check_input(irr_times, elsts, angle_distances, maximum_window_size, parameters, vel_res):
 	n = len(irr_times)
 	assert n > 1
 	assert n - 1 == len(elsts)
@@ -115,99 +735,247 @@ def atom(irr_times, elsts, angle_distances, maximum_window_size, parameters, vel
 	assert min(elsts) >= 0
 	assert vel_res > 1
 
-	disc_vels = linspace(0, parameters["v_max"], vel_res)
-	max_v = parameters["v_max"]
-	max_acc = parameters["a_max"]
-	min_acc = parameters["a_min"]
-
-	assert max_v > 0
-	assert min_acc < 0
-	assert max_acc > 0
+	assert parameters["v_max"] > 0
+	assert parameters["a_min"] < 0
+	assert parameters["a_max"] > 0
 	assert parameters["j_max"] > 0
 
-	heuristic_from_ang_idx = [sum(irr_times[i:]) - irr_times[-1] + sum(elsts[i:]) for i in range(n)]
-
-	came_from = {}
-
-	g_score = []
-	f_score = []
-
-	all_states = []
-	initial_state = State(0, 0, disc_vels, irr_times)
-	final_state = State(0, n - 1, disc_vels, irr_times, is_final=True)
-	all_states.append([initial_state])
-	has_been_visited = []
-	g_score.append([0])
-	f_score.append([heuristic_from_ang_idx[initial_state.ang_idx]])
-	has_been_visited.append([False])
-	for ang_idx in range(1, n - 1):
-		states_for_angle = []
-		has_been_visited_for_angle = []
-		g_score_for_angle = []
-		f_score_for_angle = []
-		for v_idx in range(len(disc_vels)):
-			state = State(v_idx, ang_idx, disc_vels, irr_times)
-			states_for_angle.append(state)
-			has_been_visited_for_angle.append(False)
-			g_score_for_angle.append(float('inf'))
-			f_score_for_angle.append(float('inf'))
-		g_score.append(g_score_for_angle)
-		f_score.append(f_score_for_angle)
-		has_been_visited.append(has_been_visited_for_angle)
-		all_states.append(states_for_angle)
-
-	has_been_visited.append([False])
-	all_states.append([final_state])
-	g_score.append([float('inf')])
-	f_score.append([float('inf')])
-
-	open_set = set([initial_state])
 
-	found_it = False
-	while len(open_set) > 0:
-		current = find_current(open_set, f_score)
-		assert not has_been_visited[current.ang_idx][current.v_idx]
-		has_been_visited[current.ang_idx][current.v_idx] = True
-		if current == final_state:
-			assert heuristic_from_ang_idx[current.ang_idx] == 0
-			found_it = True
+def solve(problem, method):
+	# Returns (float('inf'), None) if there is no feasible trajectory. Closes the problem when done.
+	assert method in ("astar", "bidirectional", "dp"), "Unknown method " + str(method)
+	try:
+		if method == "astar":
+			return solve_astar(problem)
+		if method == "bidirectional":
+			return solve_bidirectional(problem)
+		return solve_dp(problem)
+	finally:
+		problem.close()
+		if problem.stats is not None and problem.stats.callback is not None:
+			problem.stats.callback(problem.stats)
+
+
+def native_supported(parameters, cache, method, workers, vel_bounds, cost_table=None):
+	# The compiled backend only has A* with Ruckig edge costs, without a cache, cost table, worker processes or velocity bounds.
+	return method == "astar" and cache is None and cost_table is None and workers is None and vel_bounds is None and parameters["j_max"] != float('inf')
+
+
+def native_backend(parameters, cache, method, workers, vel_bounds, cost_table, heuristic, stats):
+	"""
+	Whether backend="auto" uses the native backend: only if it is built and does exactly what is asked, i.e. the
+	"switching" heuristic (or None, the default of the backend) and no stats, which it only partly fills in. Otherwise
+	the Python backend is used, with a warning if the native one could have been used with other arguments.
+	"""
+	if atom_native is None or not native_supported(parameters, cache, method, workers, vel_bounds, cost_table):
+		return False
+	if heuristic in (None, "switching") and stats is None:
+		return True
+	warnings.warn("atom() uses the Python backend, since the native one only has the \"switching\" heuristic and does not fill in all of the stats; pass backend=\"python\" to select it explicitly", stacklevel=3)
+	return False
+
+
+def solve_native(irr_times, elsts, angle_distances, maximum_window_size, parameters, vel_res, stats=None):
+	# Returns (float('inf'), None) if there is no feasible trajectory, like solve().
+	t0 = time.perf_counter()
+	time_val, v_idxs, expanded, edges, solver_calls, infeasible = atom_native.solve_astar(list(irr_times), list(elsts), list(angle_distances), maximum_window_size, parameters["v_max"], parameters["a_max"], parameters["a_min"], parameters["j_max"], vel_res)
+	if stats is not None:
+		stats.seconds["search"] += time.perf_counter() - t0
+		stats.count_expansions(expanded)
+		stats.edges_evaluated += edges
+		stats.solver_calls += solver_calls
+		stats.infeasible_edges += infeasible
+		if stats.callback is not None:
+			stats.callback(stats)
+	if time_val == float('inf'):
+		return time_val, None
+	return time_val, velocity_profile(v_idxs, parameters["v_max"], vel_res)
+
+
+def atom(irr_times, elsts, angle_distances, maximum_window_size, parameters, vel_res=256, cache=None, method="astar", workers=None, chunksize=1, vel_bounds=None, heuristic=None, stats=None, backend="auto", trajectory=False, cost_table=None):
+	"""
+	cache can be an ATOM_costs.EdgeCostCache, to share edge costs between calls.
+	method is the search algorithm: "astar", "bidirectional" (A* from both ends of the arc) or "dp" (layer by layer
+	dynamic programming, which evaluates more edges but has a more predictable running time).
+	workers is the number of processes that compute the edge costs ahead of the search, chunksize layer transitions at
+	a time. This evaluates every edge of a transition, also the ones that A* would not need, and the cache is not used.
+	vel_bounds is an optional list with one (v_min, v_max) interval per layer, that the velocity of the layer has to be
+	in. The bounds of the first and the last layer are ignored, since the gantry is still there.
+	heuristic is the A* heuristic, "relaxed" or "switching" (see astar_heuristic()). None selects the one of the backend,
+	"relaxed" for Python and "switching" for native, which give the same delivery time.
+	stats can be an ATOM_costs.SearchStats, which is filled in with counters and timings of the search.
+	backend is "python", "native" (the compiled A* in atom_native.cpp, which uses the "switching" heuristic and only
+	counts expansions, edges and solver calls in stats) or "auto", which uses the native backend if it is built and
+	implements the other arguments exactly (see native_backend()).
+	cost_table is an ATOM_cost_table.EdgeCostTable of precomputed transition durations for the machine parameters.
+	Transitions that it does not cover are computed as usual.
+	With trajectory, an ATOM_trajectory.ArcTrajectory with the segment durations, dead times and windows of the solution
+	is returned as well, as (delivery time, velocities, trajectory).
+	"""
+	check_input(irr_times, elsts, angle_distances, maximum_window_size, parameters, vel_res)
+	assert backend in ("auto", "python", "native"), "Unknown backend " + str(backend)
+	if backend == "native":
+		assert atom_native is not None, "The native backend is not built, see the readme"
+		assert native_supported(parameters, cache, method, workers, vel_bounds, cost_table), "The native backend only supports method=\"astar\" with finite j_max, and no cache, cost table, workers or vel_bounds"
+	if backend == "native" or (backend == "auto" and native_backend(parameters, cache, method, workers, vel_bounds, cost_table, heuristic, stats)):
+		time_val, traj = solve_native(irr_times, elsts, angle_distances, maximum_window_size, parameters, vel_res, stats)
+	else:
+		t0 = time.perf_counter()
+		problem = SearchProblem(irr_times, elsts, angle_distances, maximum_window_size, parameters, vel_res, cache, workers, chunksize, vel_bounds, heuristic or "relaxed", stats, cost_table)
+		if stats is not None:
+			stats.seconds["setup"] += time.perf_counter() - t0
+		time_val, traj = solve(problem, method)
+	assert time_val < float('inf')
+	if trajectory:
+		return time_val, traj, ArcTrajectory(irr_times, elsts, angle_distances, parameters, traj)
+	return time_val, traj
+
+
+RefinementResult = namedtuple("RefinementResult", ["delivery_time", "vels", "gap", "levels"])
+
+
+def refinement_resolutions(coarse_vel_res, vel_res):
+	# Every level halves the velocity step, so that the grid of a level contains the grid of the previous one. The last
+	# step goes directly to vel_res, which can be up to twice as fine as the previous level.
+	resolutions = [coarse_vel_res]
+	while 2 * (2 * resolutions[-1] - 1) - 1 <= vel_res:
+		resolutions.append(2 * resolutions[-1] - 1)
+	if resolutions[-1] != vel_res:
+		resolutions.append(vel_res)
+	return resolutions
+
+
+def atom_coarse_to_fine(irr_times, elsts, angle_distances, maximum_window_size, parameters, vel_res=1024, coarse_vel_res=64, band_width=2, time_tolerance=0.0, cache=None, method="astar", workers=None, chunksize=1, stats=None):
+	"""
+	Approximates atom() at vel_res for a fraction of the cost. The problem is first solved at coarse_vel_res. Then the
+	velocity step is halved repeatedly until vel_res is reached, and every time the velocity of each layer is restricted
+	to band_width steps of the previous level around the previous solution. If there is no feasible trajectory within
+	the bands, they are widened. The refinement stops early if the delivery time improves by at most time_tolerance.
+
+	Returns a RefinementResult, where levels is a list of (vel_res, delivery_time, seconds) for each level, and gap is
+	the improvement of the delivery time in the last level, an estimate of how far the result is from the optimum. The
+	gap can be slightly negative if the grid at vel_res does not contain the grid of the previous level. stats, an
+	optional ATOM_costs.SearchStats, adds up the searches of all levels.
+	"""
+	assert coarse_vel_res <= vel_res
+	assert band_width > 0
+	check_input(irr_times, elsts, angle_distances, maximum_window_size, parameters, vel_res)
+	n = len(irr_times)
+	v_max = parameters["v_max"]
+
+	levels = []
+	time_val = float('inf')
+	vels = None
+	gap = float('inf')
+	for level_vel_res in refinement_resolutions(coarse_vel_res, vel_res):
+		t0 = time.perf_counter()
+		width = None if vels is None else band_width * v_max / (levels[-1][0] - 1)
+		while True:
+			vel_bounds = None if width is None else [(vels[i] - width, vels[i] + width) for i in range(n)]
+			problem = SearchProblem(irr_times, elsts, angle_distances, maximum_window_size, parameters, level_vel_res, cache, workers, chunksize, vel_bounds, stats=stats)
+			level_time_val, level_vels = solve(problem, method)
+			if level_time_val < float('inf') or width is None:
+				break
+			width = 2 * width if 2 * width < v_max else None
+
+		assert level_time_val < float('inf')
+		levels.append((level_vel_res, level_time_val, time.perf_counter() - t0))
+		if vels is not None:
+			gap = time_val - level_time_val
+		time_val = level_time_val
+		vels = level_vels
+		if gap <= time_tolerance:
 			break
 
-		open_set.remove(current)
-		current_g_score = g_score[current.ang_idx][current.v_idx]
-
-		neighs = get_neighs(all_states, current, has_been_visited)
-		for neigh in neighs:
-			assert neigh.ang_idx == current.ang_idx + 1
-		if len(neighs) > 0:
-			angle_dist_between_center_points = angle_distances[current.ang_idx]
-
-			local_max_vel = sqrt(2 * max_acc * (angle_dist_between_center_points - current.half_window) + current.vel_square)
-			local_min_vel = 0 if 2 * min_acc * (angle_dist_between_center_points - current.half_window) + current.vel_square < 0 else sqrt(2 * min_acc * (angle_dist_between_center_points - current.half_window) + current.vel_square)
-
-			g_scores_neighs = g_score[neighs[0].ang_idx]
-			f_scores_neighs = f_score[neighs[0].ang_idx]
-			elst = elsts[current.ang_idx]
-			irr_time_from = irr_times[current.ang_idx]
-			for neigh_state in neighs:
-				if neigh_state.v > local_max_vel or neigh_state.v < local_min_vel:
-					continue
-				d = calc_time_between_segments(irr_times, elsts, angle_distances, maximum_window_size, neigh_state.ang_idx, current.v, neigh_state.v, parameters)
-				if d != float('inf'):
-					tentative_g_score = current_g_score + d
-					if tentative_g_score <= g_scores_neighs[neigh_state.v_idx]:
-						came_from[neigh_state] = current
-						g_scores_neighs[neigh_state.v_idx] = tentative_g_score
-						f_scores_neighs[neigh_state.v_idx] = tentative_g_score + heuristic_from_ang_idx[neigh_state.ang_idx]
-
-						if has_been_visited[neigh_state.ang_idx][neigh_state.v_idx] == False and neigh_state not in open_set:
-							open_set.add(neigh_state)
-
-	assert found_it
-	time_val = g_score[current.ang_idx][current.v_idx] + irr_times[-1]
-	traj = [current.v_idx]
-	while current in came_from:
-		traj.append(max_v * came_from[current].v_idx / (vel_res - 1))
-		current = came_from[current]
-	traj = list(reversed(traj))
-	return time_val, traj
+	return RefinementResult(time_val, vels, gap, levels)
+
+
+AnytimeResult = namedtuple("AnytimeResult", ["delivery_time", "vels", "lower_bound", "gap", "optimal", "expansions", "seconds", "incumbents"])
+
+
+def atom_anytime(irr_times, elsts, angle_distances, maximum_window_size, parameters, vel_res=256, time_budget=None, max_expansions=None, weight=2.0, cache=None, heuristic="relaxed", stats=None, heuristic_share=0.5):
+	"""
+	Like atom(), but stops when time_budget seconds (including the set up of the search and the heuristic) or
+	max_expansions expansions are used up, and returns the best trajectory found so far. weight > 1 makes the search
+	greedier, so that a first trajectory is found sooner (see solve_anytime()).
+
+	Before the search, surrogate_trajectory() gives a first trajectory in a fraction of a second. The relaxed heuristic
+	may use up to heuristic_share of the time budget, after which the layers it did not reach get a cheaper bound.
+
+	Returns an AnytimeResult, where lower_bound is a proven lower bound on the optimal delivery time, gap the
+	difference between the two, and optimal whether the search finished, so that delivery_time is the optimum.
+	incumbents lists (seconds, delivery time) of every improvement. Without a trajectory, delivery_time is infinite
+	and vels None.
+	"""
+	assert weight >= 1
+	check_input(irr_times, elsts, angle_distances, maximum_window_size, parameters, vel_res)
+	t0 = time.perf_counter()
+	deadline = None if time_budget is None else t0 + time_budget
+	problem = SearchProblem(irr_times, elsts, angle_distances, maximum_window_size, parameters, vel_res, cache, heuristic=heuristic, stats=stats)
+	initial = surrogate_trajectory(problem)
+	heuristic_deadline = None if time_budget is None else t0 + heuristic_share * time_budget
+	time_val, vels, lower_bound, expansions, incumbents = solve_anytime(problem, weight, deadline, max_expansions, heuristic_deadline, initial)
+	seconds = time.perf_counter() - t0
+	if stats is not None:
+		stats.seconds["search"] += seconds
+	# The lower bound can exceed the delivery time by rounding, when the search finished.
+	optimal = lower_bound >= time_val
+	lower_bound = min(lower_bound, time_val)
+	gap = 0.0 if optimal else time_val - lower_bound
+	incumbents = [(t - t0, delivery_time) for t, delivery_time in incumbents]
+	return AnytimeResult(time_val, vels, lower_bound, gap, optimal, expansions, seconds, incumbents)
+
+
+BatchResult = namedtuple("BatchResult", ["delivery_time", "vels", "seconds"])
+
+# The edge cost cache of a process that solves batch problems.
+batch_cache = None
+
+
+def init_batch_worker(cache_file):
+	global batch_cache
+	batch_cache = None if cache_file is None else EdgeCostCache(path=cache_file)
+
+
+def solve_batch_problem(problem):
+	t0 = time.perf_counter()
+	if batch_cache is not None:
+		problem = dict(problem, cache=batch_cache)
+	delivery_time, vels = atom(**problem)
+	if batch_cache is not None:
+		batch_cache.flush()
+	return BatchResult(delivery_time, vels, time.perf_counter() - t0)
+
+
+def batch_problem_size(problem):
+	# Rough estimate of the work, which is dominated by the number of edges.
+	return len(problem["irr_times"]) * problem.get("vel_res", 256) ** 2
+
+
+def atom_batch(problems, workers=None, cache_file=None):
+	"""
+	Solves many independent ATOM problems, e.g. all arcs of all beams of a plan, in a process pool.
+
+	Each problem is a dict with keyword arguments for atom(). The problems are started largest first, and the results
+	are returned in the same order as the problems, as BatchResults that also contain the time each problem took.
+	workers is the number of processes (None means one per core, 1 solves the problems one by one in this process).
+	cache_file is the path to an edge cost cache that the processes share.
+	"""
+	order = sorted(range(len(problems)), key=lambda i: -batch_problem_size(problems[i]))
+	results = [None] * len(problems)
+	if workers == 1:
+		init_batch_worker(cache_file)
+		try:
+			for i in order:
+				results[i] = solve_batch_problem(problems[i])
+		finally:
+			if batch_cache is not None:
+				batch_cache.close()
+			init_batch_worker(None)
+		return results
+
+	with ProcessPoolExecutor(max_workers=workers, initializer=init_batch_worker, initargs=(cache_file,)) as executor:
+		futures = {executor.submit(solve_batch_problem, problems[i]): i for i in order}
+		for future in as_completed(futures):
+			results[futures[future]] = future.result()
+	return results
@@ -0,0 +1,122 @@
+"""
+Delivery times of many exported plans (see ATOM_plan.py), without RayStation.
+
+The plans are solved in a process pool as they are read, and every result is appended to the output file as one JSON
+line as soon as it is available, so that an interrupted run can be continued with --resume. The lines are in the order
+in which the plans finish, and have the keys name, delivery_time, layers and seconds (and vels with --vels), or name
+and error for plans that could not be read or solved.
+
+Usage: python ATOM_cli.py plans/ [--output results.jsonl] [--workers 4] [--vel-res 256] [--resume]
+       python ATOM_cli.py plans.jsonl ...
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import ATOM
+from ATOM import init_batch_worker, solve_batch_problem
+from ATOM_plan import iter_plans, plan_problem
+
+
+def solve_plan(plan, options):
+	result = solve_batch_problem(dict(plan_problem(plan), **options))
+	return {"name": plan["name"], "delivery_time": result.delivery_time, "layers": len(plan["irr_times"]), "seconds": result.seconds, "vels": result.vels}
+
+
+def finished_names(path):
+	# The plans that already have a result (and not an error) in the output file.
+	names = set()
+	if os.path.exists(path):
+		with open(path) as f:
+			for line in f:
+				try:
+					record = json.loads(line)
+				except ValueError:
+					continue  # The last line of an interrupted run.
+				if "error" not in record:
+					names.add(record["name"])
+	return names
+
+
+def run(source, output, workers=None, options=None, cache_file=None, resume=False, vels=False, max_pending=None):
+	"""
+	Solves the plans in source with atom(**options) and appends the results to the file output. workers is the number
+	of processes (None means one per core, 1 solves the plans one by one in this process), and at most max_pending
+	plans (by default 4 per process) are read ahead. Returns the number of solved plans and of errors.
+	"""
+	options = {} if options is None else options
+	skip = finished_names(output) if resume else set()
+	counts = {"solved": 0, "errors": 0}
+	with open(output, "a") as f:
+		def write(record):
+			if not vels:
+				record.pop("vels", None)
+			counts["errors" if "error" in record else "solved"] += 1
+			f.write(json.dumps(record) + "\n")
+			f.flush()
+
+		def on_error(name, e):
+			write({"name": name, "error": "%s: %s" % (type(e).__name__, e)})
+
+		plans = (plan for plan in iter_plans(source, on_error) if plan["name"] not in skip)
+		if workers == 1:
+			init_batch_worker(cache_file)
+			try:
+				for plan in plans:
+					try:
+						write(solve_plan(plan, options))
+					except Exception as e:
+						on_error(plan["name"], e)
+			finally:
+				if ATOM.batch_cache is not None:
+					ATOM.batch_cache.close()
+				init_batch_worker(None)
+			return counts["solved"], counts["errors"]
+
+		max_pending = 4 * (workers or os.cpu_count() or 1) if max_pending is None else max_pending
+		with ProcessPoolExecutor(max_workers=workers, initializer=init_batch_worker, initargs=(cache_file,)) as executor:
+			pending = {}
+			exhausted = False
+			while pending or not exhausted:
+				while not exhausted and len(pending) < max_pending:
+					plan = next(plans, None)
+					if plan is None:
+						exhausted = True
+					else:
+						pending[executor.submit(solve_plan, plan, options)] = plan["name"]
+				if not pending:
+					break
+				done, _ = wait(pending, return_when=FIRST_COMPLETED)
+				for future in done:
+					name = pending.pop(future)
+					try:
+						write(future.result())
+					except Exception as e:
+						on_error(name, e)
+	return counts["solved"], counts["errors"]
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("source", help="Directory of .json and .npz plans, .jsonl file of plans, or a single plan.")
+	parser.add_argument("--output", default="results.jsonl", help="JSON lines file that the results are appended to.")
+	parser.add_argument("--workers", type=int, help="Number of processes, one per core by default.")
+	parser.add_argument("--vel-res", type=int, default=256, help="Number of discrete velocities.")
+	parser.add_argument("--method", default="astar", choices=["astar", "bidirectional", "dp"], help="Search algorithm used by atom().")
+	parser.add_argument("--backend", default="auto", choices=["auto", "python", "native"], help="Backend of atom().")
+	parser.add_argument("--cache-file", help="SQLite file for an edge cost cache that is shared by the processes.")
+	parser.add_argument("--resume", action="store_true", help="Skip the plans that already have a result in the output file.")
+	parser.add_argument("--vels", action="store_true", help="Also write the velocities of the layers.")
+	args = parser.parse_args()
+
+	options = {"vel_res": args.vel_res, "method": args.method, "backend": args.backend}
+	t0 = time.perf_counter()
+	solved, errors = run(args.source, args.output, args.workers, options, args.cache_file, args.resume, args.vels)
+	print("%d plans solved, %d errors, in %.1f s" % (solved, errors, time.perf_counter() - t0), file=sys.stderr)
+
+
+if __name__ == '__main__':
+	main()
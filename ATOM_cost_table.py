@@ -0,0 +1,163 @@
+"""
+Precomputed transition durations of one machine model, which replace the solver calls of the search by table lookups.
+
+When the layers are equally spaced, as in most arcs, the remaining angle of a transition is the spacing minus half of
+the two windows, so it is always in [angle_distance - max_window, angle_distance]. Together with the discrete
+velocities and the few distinct energy layer switching times of a machine, the durations fit in a table
+durations[elst, v0, v1, remaining angle] that is built once and stored as a .npy file (with the grid in a .json file
+next to it), which is memory mapped when it is loaded.
+
+Usage: python ATOM_cost_table.py table.npy [--vel-res 256] [--angle-min 0.0] [--angle-max 2.0] [--angles 65]
+       [--elsts 0.5 5.0] [--j-max 0.5] [--workers 4]
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from math import floor
+
+import numpy as np
+
+from ATOM_costs import TransitionSolver, make_solver
+
+
+class EdgeCostTable():
+	"""
+	durations[e, i, j, k] is the duration of the transition from velocity disc_vels[i] to disc_vels[j] over the remaining
+	angle angles[k], with the energy layer switching time elsts[e], for the machine parameters.
+
+	Remaining angles in between the grid points are looked up with mode "upper", the larger duration of the two
+	neighbouring grid points (infinite if either is infeasible), or "linear" interpolation. "upper" does not underestimate
+	the duration as long as it has a single minimum as a function of the remaining angle, so that the delivery times
+	are conservative. duration() returns None if the transition is not covered by the table.
+	"""
+	def __init__(self, durations, parameters, vel_res, angles, elsts, mode="upper"):
+		assert mode in ("upper", "linear"), "Unknown mode " + str(mode)
+		assert durations.shape == (len(elsts), vel_res, vel_res, len(angles))
+		assert len(angles) > 1
+		self.durations = durations
+		self.parameters = dict(parameters)
+		self.vel_res = vel_res
+		self.angles = np.asarray(angles, dtype=float)
+		self.elsts = [float(elst) for elst in elsts]
+		self.mode = mode
+		self.elst_idx = {elst: e for e, elst in enumerate(self.elsts)}
+		self.vel_step = parameters["v_max"] / (vel_res - 1)
+		self.angle_min = float(self.angles[0])
+		self.angle_step = float(self.angles[1] - self.angles[0])
+		self.lookups = 0
+
+	def vel_idx(self, v):
+		# The index of v on the velocity grid of the table, or -1 if it is not a grid velocity.
+		i = round(v / self.vel_step)
+		if i >= self.vel_res or abs(i * self.vel_step - v) > 1.0e-9 * self.vel_step:
+			return -1
+		return i
+
+	def duration(self, v0, v1, remaining_angle, elst):
+		e = self.elst_idx.get(elst)
+		if e is None:
+			return None
+		i = self.vel_idx(v0)
+		j = self.vel_idx(v1)
+		position = (remaining_angle - self.angle_min) / self.angle_step
+		if i < 0 or j < 0 or position < 0 or position > len(self.angles) - 1:
+			return None
+		self.lookups += 1
+		k = min(floor(position), len(self.angles) - 2)
+		below, above = self.durations[e, i, j, k:k + 2].tolist()
+		fraction = position - k
+		if fraction == 0.0:
+			return below
+		if below == float('inf') or above == float('inf'):
+			return float('inf')
+		if self.mode == "upper":
+			return max(below, above)
+		return below + fraction * (above - below)
+
+	def save(self, path):
+		# Writes the durations to path (a .npy file) and the grid to path + ".json".
+		np.save(path, np.asarray(self.durations))
+		metadata = {"parameters": self.parameters, "vel_res": self.vel_res, "angles": self.angles.tolist(), "elsts": self.elsts}
+		with open(path + ".json", "w") as f:
+			json.dump(metadata, f, indent=1)
+
+
+def load_cost_table(path, mode="upper"):
+	# The durations are memory mapped, so that only the parts that the search needs are read.
+	with open(path + ".json") as f:
+		metadata = json.load(f)
+	parameters = {key: float(value) for key, value in metadata["parameters"].items()}
+	durations = np.load(path, mmap_mode="r")
+	return EdgeCostTable(durations, parameters, metadata["vel_res"], metadata["angles"], metadata["elsts"], mode)
+
+
+def table_row(parameters, disc_vels, angles, elst, i):
+	# Durations from disc_vels[i] to all velocities and remaining angles, as an array of shape (vel_res, len(angles)).
+	solver = TransitionSolver(parameters)
+	v0 = disc_vels[i]
+	row = np.full((len(disc_vels), len(angles)), float('inf'))
+	for j, v1 in enumerate(disc_vels):
+		# Velocity changes that the acceleration limits can not make within the longest remaining angle are skipped.
+		if v1 * v1 - v0 * v0 > 2 * parameters["a_max"] * angles[-1] or v0 * v0 - v1 * v1 > -2 * parameters["a_min"] * angles[-1]:
+			continue
+		for k, remaining_angle in enumerate(angles):
+			if remaining_angle > 0:
+				row[j, k] = solver.duration(v0, v1, remaining_angle, elst)
+	return row
+
+
+def build_cost_table(parameters, vel_res, angles, elsts, workers=None, mode="upper"):
+	"""
+	Computes the table for the remaining angles angles (an equally spaced, increasing sequence) and the energy layer
+	switching times elsts. Without a jerk limit, the closed form solver computes the whole table at once. Otherwise
+	every (elst, v0) row is computed by Ruckig, in workers processes if given.
+	"""
+	angles = np.asarray(angles, dtype=float)
+	assert np.allclose(np.diff(angles), angles[1] - angles[0]) and angles[1] > angles[0]
+	disc_vels = [i * (parameters["v_max"] / (vel_res - 1)) for i in range(vel_res)]
+	durations = np.full((len(elsts), vel_res, vel_res, len(angles)), float('inf'))
+	if parameters["j_max"] == float('inf'):
+		solver = make_solver(parameters)
+		v = np.asarray(disc_vels)
+		for e, elst in enumerate(elsts):
+			with np.errstate(invalid='ignore'):
+				durations[e] = solver.durations(v[:, None, None], v[None, :, None], angles[None, None, :], elst)
+			durations[e][:, :, angles <= 0] = float('inf')
+		return EdgeCostTable(durations, parameters, vel_res, angles, elsts, mode)
+
+	tasks = [(e, i) for e in range(len(elsts)) for i in range(vel_res)]
+	if workers is None:
+		rows = [table_row(parameters, disc_vels, angles, elsts[e], i) for e, i in tasks]
+	else:
+		with ProcessPoolExecutor(max_workers=workers) as executor:
+			rows = list(executor.map(table_row, *zip(*[(parameters, disc_vels, angles, elsts[e], i) for e, i in tasks]), chunksize=4))
+	for (e, i), row in zip(tasks, rows):
+		durations[e, i] = row
+	return EdgeCostTable(durations, parameters, vel_res, angles, elsts, mode)
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("path", help="Output .npy file, the grid is written to PATH.json.")
+	parser.add_argument("--vel-res", type=int, default=256)
+	parser.add_argument("--angle-min", type=float, default=0.0, help="Smallest remaining angle, angle_distance - max_window for equally spaced layers.")
+	parser.add_argument("--angle-max", type=float, default=2.0, help="Largest remaining angle, the angle_distance of equally spaced layers.")
+	parser.add_argument("--angles", type=int, default=65, help="Number of remaining angles in the grid.")
+	parser.add_argument("--elsts", type=float, nargs="+", default=[0.5, 5.0], help="Energy layer switching times.")
+	parser.add_argument("--v-max", type=float, default=5.0)
+	parser.add_argument("--a-max", type=float, default=0.5)
+	parser.add_argument("--a-min", type=float, default=-0.5)
+	parser.add_argument("--j-max", type=float, default=0.5, help="Maximum jerk, inf selects the acceleration limited model.")
+	parser.add_argument("--workers", type=int, help="Number of processes.")
+	args = parser.parse_args()
+
+	parameters = {"v_max": args.v_max, "a_max": args.a_max, "a_min": args.a_min, "j_max": args.j_max}
+	t0 = time.perf_counter()
+	table = build_cost_table(parameters, args.vel_res, np.linspace(args.angle_min, args.angle_max, args.angles), args.elsts, args.workers)
+	table.save(args.path)
+	print("%d durations in %.1f s, %.1f MB" % (table.durations.size, time.perf_counter() - t0, table.durations.nbytes / 1.0e6))
+
+
+if __name__ == '__main__':
+	main()
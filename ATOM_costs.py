@@ -0,0 +1,625 @@
+"""
+Edge costs for ATOM, i.e. the time it takes to irradiate one energy layer and then move to the next one.
+"""
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from math import isfinite, sqrt
+from time import perf_counter
+
+import numpy as np
+from ruckig import InputParameter, Result, Ruckig, Trajectory  # pip install ruckig
+
+
+class SearchStats():
+	"""
+	Counters and timers that atom() fills in when it gets a SearchStats as stats. They add up over several calls.
+
+	expanded: states whose neighbours were generated (for method="dp", the reachable states of each layer).
+	edges_evaluated: edges whose cost was looked up or computed.
+	window_rejected, kinematic_rejected: candidate edges that were never evaluated, because the window of the neighbour is
+	too large (or it is outside vel_bounds), or because the acceleration limits can not reach its velocity.
+	solver_calls, infeasible_edges, ruckig_failures: calls of the transition solver (cache hits excluded), how many of
+	them found no trajectory, and how many of those because Ruckig raised or rejected the input.
+	table_lookups: edge costs that were taken from a precomputed cost table instead.
+	seconds: wall time per phase, "setup", "heuristic", "search", "path" (the reconstruction of the result), and
+	"edge_costs", the part of the search that is spent in the transition solver. Work done by worker processes is not
+	counted.
+
+	callback is called with the stats every callback_every expanded states, and at the end of every search.
+	"""
+	def __init__(self, callback=None, callback_every=10000):
+		self.expanded = 0
+		self.edges_evaluated = 0
+		self.window_rejected = 0
+		self.kinematic_rejected = 0
+		self.solver_calls = 0
+		self.infeasible_edges = 0
+		self.ruckig_failures = 0
+		self.table_lookups = 0
+		self.seconds = {"setup": 0.0, "heuristic": 0.0, "search": 0.0, "edge_costs": 0.0, "path": 0.0}
+		self.callback = callback
+		self.callback_every = callback_every
+
+	def count_expansions(self, count=1):
+		before = self.expanded
+		self.expanded += count
+		if self.callback is not None and self.expanded // self.callback_every != before // self.callback_every:
+			self.callback(self)
+
+	def as_dict(self):
+		return {key: (dict(value) if key == "seconds" else value) for key, value in vars(self).items() if key not in ("callback", "callback_every")}
+
+
+class TransitionSolver():
+	"""
+	Minimum time gantry movement between two energy layers, starting and ending with zero acceleration.
+
+	The Ruckig objects are created once and only the fields that differ between the transitions are changed for each call.
+	failures counts the calls where Ruckig raised or rejected the input.
+	"""
+	def __init__(self, parameters):
+		self.failures = 0
+		self.otg = Ruckig(1)
+		self.inp = InputParameter(1)
+		self.trajectory = Trajectory(1)
+
+		inp = self.inp
+		inp.current_position = [0.0]
+		inp.current_acceleration = [0.0]
+		inp.target_acceleration = [0.0]
+
+		inp.max_velocity = [parameters["v_max"]]
+		inp.max_acceleration = [parameters["a_max"]]
+		inp.max_jerk = [parameters["j_max"]]
+
+		inp.min_velocity = [-1.0e-16]  # This would be 0, but there are some rounding errors that cause issues, it seems.
+		inp.min_acceleration = [parameters["a_min"]]
+
+	def duration(self, v0, v1, remaining_angle, elst):
+		inp = self.inp
+		inp.current_velocity = [v0]
+		inp.target_velocity = [v1]
+		inp.target_position = [remaining_angle]
+		inp.minimum_duration = elst
+
+		# Calculate the trajectory in an offline manner. Ruckig validates the input itself, and raises if it is invalid.
+		try:
+			result = self.otg.calculate(inp, self.trajectory)
+		except RuntimeError:
+			self.failures += 1
+			return float('inf')
+		if result == Result.ErrorInvalidInput:
+			self.failures += 1
+			return float('inf')
+
+		return self.trajectory.duration
+
+
+class AccelerationLimitedSolver():
+	"""
+	Closed form replacement of TransitionSolver for machines without a jerk limit (j_max = inf).
+
+	The fastest movement accelerates with a_max to a peak velocity, possibly cruises at v_max, and decelerates with
+	a_min. The slowest movement without going backwards instead decelerates first, and can wait at standstill if the
+	distance allows it. Every duration in between can be reached, so the minimum duration (the energy layer switching
+	time) is either met by waiting, or the transition is infeasible.
+	"""
+	def __init__(self, parameters):
+		assert parameters["j_max"] == float('inf')
+		self.v_max = parameters["v_max"]
+		self.a_max = parameters["a_max"]
+		self.b_max = -parameters["a_min"]
+
+	def duration(self, v0, v1, remaining_angle, elst):
+		# Scalar version of durations(), which avoids the NumPy overhead for single edges.
+		a = self.a_max
+		b = self.b_max
+		v_max = self.v_max
+		v0_square = v0 * v0
+		v1_square = v1 * v1
+		if v1 >= v0:
+			if v1_square - v0_square > 2 * a * remaining_angle:
+				return float('inf')
+		elif v0_square - v1_square > 2 * b * remaining_angle:
+			return float('inf')
+
+		peak = sqrt(max((2 * a * b * remaining_angle + b * v0_square + a * v1_square) / (a + b), 0.0))
+		if peak <= v_max:
+			fastest = (peak - v0) / a + (peak - v1) / b
+		else:
+			cruise_dist = remaining_angle - (v_max * v_max - v0_square) / (2 * a) - (v_max * v_max - v1_square) / (2 * b)
+			fastest = (v_max - v0) / a + (v_max - v1) / b + cruise_dist / v_max
+		if elst <= fastest:
+			return fastest
+
+		low_square = (a * v0_square + b * v1_square - 2 * a * b * remaining_angle) / (a + b)
+		if low_square > 0:
+			low = sqrt(low_square)
+			if elst > (v0 - low) / b + (v1 - low) / a:
+				return float('inf')
+		return elst
+
+	def durations(self, v0, v1, remaining_angle, elst):
+		# Vectorised over any arguments that are arrays.
+		v0 = np.asarray(v0, dtype=float)
+		v1 = np.asarray(v1, dtype=float)
+		dist = np.asarray(remaining_angle, dtype=float)
+		a = self.a_max
+		b = self.b_max
+		v_max = self.v_max
+		v0_square = v0 * v0
+		v1_square = v1 * v1
+
+		# The target velocity has to be reachable within the distance.
+		reachable = np.where(v1 >= v0, v1_square - v0_square <= 2 * a * dist, v0_square - v1_square <= 2 * b * dist)
+
+		with np.errstate(invalid='ignore', divide='ignore'):
+			peak = np.sqrt(np.maximum((2 * a * b * dist + b * v0_square + a * v1_square) / (a + b), 0.0))
+			no_cruise = (peak - v0) / a + (peak - v1) / b
+			cruise_dist = dist - (v_max * v_max - v0_square) / (2 * a) - (v_max * v_max - v1_square) / (2 * b)
+			cruise = (v_max - v0) / a + (v_max - v1) / b + cruise_dist / v_max
+			fastest = np.where(peak <= v_max, no_cruise, cruise)
+
+			low_square = (a * v0_square + b * v1_square - 2 * a * b * dist) / (a + b)
+			low = np.sqrt(np.maximum(low_square, 0.0))
+			slowest = np.where(low_square <= 0, float('inf'), (v0 - low) / b + (v1 - low) / a)
+
+		durations = np.maximum(fastest, elst)
+		return np.where(reachable & (elst <= slowest), durations, float('inf'))
+
+
+class TransitionLowerBound():
+	"""
+	Vectorised lower bound on the durations of TransitionSolver, for search heuristics.
+
+	Besides the acceleration limited duration and feasibility, the jerk limit bounds the time it takes to change the velocity from v0
+	to v1, and the distance that can be covered: with zero acceleration at both ends, the velocity after t seconds is at
+	most v0 + j*t^2/2, and t seconds before the end at most v1 + j*t^2/2. The smallest duration for which this distance
+	reaches the remaining angle is found by bisection.
+	"""
+	def __init__(self, parameters):
+		self.j_max = parameters["j_max"]
+		self.a_max = parameters["a_max"]
+		self.b_max = -parameters["a_min"]
+		self.acceleration_limited = AccelerationLimitedSolver(dict(parameters, j_max=float('inf')))
+
+	def acceleration_bound(self, v0, v1, remaining_angle, elst):
+		# The bound without the jerk limit, which is the same for all j_max.
+		v0 = np.asarray(v0, dtype=float)
+		v1 = np.asarray(v1, dtype=float)
+		dist = np.asarray(remaining_angle, dtype=float)
+		# The acceleration limited model can reach every duration that the jerk limited one can, so a transition that is
+		# infeasible there is infeasible for Ruckig too. The feasibility test is done with a little slack, such that
+		# rounding can not make a feasible transition infinitely expensive.
+		feasible = np.isfinite(self.acceleration_limited.durations(v0, v1, dist * (1 + 1.0e-9) + 1.0e-12, elst * (1 - 1.0e-9)))
+		fastest = self.acceleration_limited.durations(v0, v1, dist, 0.0)
+		return np.where(feasible, np.maximum(np.where(np.isfinite(fastest), fastest, 0.0), elst), float('inf'))
+
+	def durations(self, v0, v1, remaining_angle, elst, iterations=16, bound=None):
+		# bound can be the result of acceleration_bound() for the same arguments, e.g. from another j_max.
+		v0 = np.asarray(v0, dtype=float)
+		v1 = np.asarray(v1, dtype=float)
+		dist = np.asarray(remaining_angle, dtype=float)
+		if bound is None:
+			bound = self.acceleration_bound(v0, v1, dist, elst)
+		j = self.j_max
+		if j == float('inf'):
+			return bound
+
+		dv = np.abs(v1 - v0)
+		a = np.where(v1 >= v0, self.a_max, self.b_max)
+		velocity_change = np.where(dv <= a * a / j, 2 * np.sqrt(dv / j), dv / a + a / j)
+
+		# Once the velocity change fits, the distance bound is T*(v0 + v1)/2 + j*T^3/24 - dv^2/(2*j*T), which increases
+		# with T and is at least j*T^3/96.
+		def max_dist(T):
+			with np.errstate(invalid='ignore', divide='ignore'):
+				return np.where(T > 0, T * (v0 + v1) / 2 + j * T ** 3 / 24 - dv * dv / (2 * j * T), 0.0)
+
+		lo = np.broadcast_to(2 * np.sqrt(dv / j), np.broadcast(v0, v1, dist).shape)
+		hi = np.maximum(lo, np.cbrt(96 * dist / j))
+		done = max_dist(lo) >= dist
+		hi = np.where(done, lo, hi)
+		for _ in range(iterations):
+			mid = 0.5 * (lo + hi)
+			enough = max_dist(mid) >= dist
+			hi = np.where(enough, mid, hi)
+			lo = np.where(enough, lo, mid)
+		return np.maximum(bound, np.maximum(velocity_change, lo))
+
+
+def velocity_change_time(dv, a, j):
+	# Shortest time to change the velocity by dv with the acceleration limit a and the jerk limit j, from and to zero
+	# acceleration. The velocity changes symmetrically, so the distance covered meanwhile is the mean velocity times this.
+	return np.where(dv <= a * a / j, 2 * np.sqrt(dv / j), dv / a + a / j)
+
+
+def jerk_limited_feasible(v0, v1, remaining_angle, elst, parameters, iterations=30):
+	"""
+	Approximate feasibility of Ruckig transitions, vectorised. The remaining angle has to be at least the distance
+	of the direct velocity change, and the switching time at most the duration of the slowest movement: that one
+	slows down to some velocity w just in time to reach v1 at the end, or stops and waits if the remaining angle
+	allows it.
+	"""
+	a = parameters["a_max"]
+	b = -parameters["a_min"]
+	j = parameters["j_max"]
+	direct = np.where(v1 >= v0, velocity_change_time(np.abs(v1 - v0), a, j), velocity_change_time(np.abs(v1 - v0), b, j))
+	feasible = (v0 + v1) / 2 * direct <= remaining_angle
+
+	# The distance of the slowest movement decreases with w, so bisect for the w where it is the remaining angle.
+	lo = np.zeros(np.shape(remaining_angle))
+	hi = np.minimum(v0, v1)
+	for _ in range(iterations):
+		w = (lo + hi) / 2
+		too_far = (v0 + w) / 2 * velocity_change_time(v0 - w, b, j) + (v1 + w) / 2 * velocity_change_time(v1 - w, a, j) > remaining_angle
+		lo = np.where(too_far, w, lo)
+		hi = np.where(too_far, hi, w)
+	slowest = velocity_change_time(v0 - hi, b, j) + velocity_change_time(v1 - hi, a, j)
+	stop_distance = v0 / 2 * velocity_change_time(v0, b, j) + v1 / 2 * velocity_change_time(v1, a, j)
+	slowest = np.where(stop_distance <= remaining_angle, float('inf'), slowest)
+	return feasible & (elst <= slowest)
+
+
+class SurrogateCosts():
+	"""
+	Replacement of EdgeCostEngine for ATOM.solve_dp(), with the closed form lower bounds of TransitionLowerBound
+	instead of the Ruckig durations. With bound, these are the costs; otherwise the transitions that
+	jerk_limited_feasible() rejects are infeasible too, which makes the costs an estimate instead.
+
+	After precompute(disc_vels), the costs between all of the velocities in all layers are evaluated at once, which is
+	much faster for small grids, where most of the time per layer would be NumPy overhead.
+	"""
+	def __init__(self, irr_times, elsts, angle_distances, max_window, parameters, bound=True):
+		self.irr_times = irr_times
+		self.elsts = elsts
+		self.angle_distances = angle_distances
+		self.max_window = max_window
+		self.parameters = parameters
+		self.bound = bound
+		self.lower_bound = TransitionLowerBound(parameters)
+		self.disc_vels = None
+		self.costs = None
+
+	def precompute(self, disc_vels):
+		disc_vels = np.asarray(disc_vels, dtype=float)
+		irr_times = np.asarray(self.irr_times, dtype=float)
+		feasible = np.array([feasible_pairs(disc_vels, disc_vels, irr_times[idx0], irr_times[idx0 + 1], self.angle_distances[idx0], self.max_window, self.parameters) for idx0 in range(len(irr_times) - 1)])
+		idx0, i, j = np.nonzero(feasible)
+		v0s = disc_vels[i]
+		v1s = disc_vels[j]
+		elsts = np.asarray(self.elsts, dtype=float)[idx0]
+		remaining_angles = np.asarray(self.angle_distances, dtype=float)[idx0] - (v0s * irr_times[idx0] + v1s * irr_times[idx0 + 1]) / 2
+		durations = self.lower_bound.durations(v0s, v1s, remaining_angles, elsts)
+		if not self.bound and self.parameters["j_max"] != float('inf'):
+			durations[~jerk_limited_feasible(v0s, v1s, remaining_angles, elsts, self.parameters)] = float('inf')
+		self.costs = np.full(feasible.shape, float('inf'))
+		self.costs[idx0, i, j] = durations + irr_times[idx0]
+		self.disc_vels = disc_vels
+
+	def batch(self, idx, v0s, v1s):
+		if self.costs is not None:
+			return self.costs[idx - 1][np.ix_(np.searchsorted(self.disc_vels, v0s), np.searchsorted(self.disc_vels, v1s))]
+		idx0 = idx - 1
+		elst = self.elsts[idx0]
+		feasible = feasible_pairs(v0s, v1s, self.irr_times[idx0], self.irr_times[idx], self.angle_distances[idx0], self.max_window, self.parameters)
+		i, j = np.nonzero(feasible)
+		v0s = v0s[i]
+		v1s = v1s[j]
+		remaining_angles = self.angle_distances[idx0] - (v0s * self.irr_times[idx0] + v1s * self.irr_times[idx]) / 2
+		durations = self.lower_bound.durations(v0s, v1s, remaining_angles, elst)
+		if not self.bound and self.parameters["j_max"] != float('inf'):
+			durations[~jerk_limited_feasible(v0s, v1s, remaining_angles, elst, self.parameters)] = float('inf')
+		costs = np.full(feasible.shape, float('inf'))
+		costs[i, j] = durations + self.irr_times[idx0]
+		return costs
+
+
+def make_solver(parameters):
+	if parameters["j_max"] == float('inf'):
+		return AccelerationLimitedSolver(parameters)
+	return TransitionSolver(parameters)
+
+
+class EdgeCostEngine():
+	"""
+	Edge costs of the ATOM search graph for one plan.
+
+	The cost of the edge from velocity v0 in layer idx - 1 to velocity v1 in layer idx is the irradiation time of layer
+	idx - 1 plus the duration of the movement in between the two windows.
+	"""
+	def __init__(self, irr_times, elsts, angle_distances, max_window, parameters, cache=None, stats=None, table=None):
+		self.irr_times = irr_times
+		self.elsts = elsts
+		self.angle_distances = angle_distances
+		self.max_window = max_window
+		self.parameters = parameters
+		self.solver = make_solver(parameters)
+		self.stats = stats
+		# Without stats, the solver is called directly, so that the instrumentation costs nothing.
+		self.solver_duration = self.solver.duration if stats is None else self.counted_solver_duration
+		# The closed form solver is cheaper than a cache lookup, so the cache is only used for Ruckig.
+		self.cache = cache if isinstance(self.solver, TransitionSolver) else None
+		if self.cache is None:
+			self.duration = self.solver_duration
+		else:
+			self.parameter_key = cache.key(parameters["v_max"], parameters["a_max"], parameters["a_min"], parameters["j_max"])
+			self.duration = self.cached_duration
+		# A precomputed ATOM_cost_table.EdgeCostTable is looked up first, and the transitions it does not cover fall back
+		# to the cache or the solver. Like the cache, it is only used for Ruckig.
+		self.table = table if isinstance(self.solver, TransitionSolver) else None
+		if self.table is not None:
+			assert table.parameters == {key: float(parameters[key]) for key in ("v_max", "a_max", "a_min", "j_max")}, "The cost table is for other machine parameters"
+			self.uncovered_duration = self.duration
+			self.duration = self.table_duration
+
+	def cached_duration(self, v0, v1, remaining_angle, elst):
+		key = self.cache.edge_key(v0, v1, remaining_angle, elst) + self.parameter_key
+		duration = self.cache.get(key)
+		if duration is None:
+			duration = self.solver_duration(v0, v1, remaining_angle, elst)
+			self.cache.put(key, duration)
+		return duration
+
+	def table_duration(self, v0, v1, remaining_angle, elst):
+		duration = self.table.duration(v0, v1, remaining_angle, elst)
+		if duration is None:
+			return self.uncovered_duration(v0, v1, remaining_angle, elst)
+		if self.stats is not None:
+			self.stats.table_lookups += 1
+		return duration
+
+	def counted_solver_duration(self, v0, v1, remaining_angle, elst):
+		stats = self.stats
+		failures = getattr(self.solver, "failures", 0)
+		t0 = perf_counter()
+		duration = self.solver.duration(v0, v1, remaining_angle, elst)
+		stats.seconds["edge_costs"] += perf_counter() - t0
+		stats.solver_calls += 1
+		if duration == float('inf'):
+			stats.infeasible_edges += 1
+			stats.ruckig_failures += getattr(self.solver, "failures", 0) - failures
+		return duration
+
+	def cost(self, idx, v0, v1):
+		assert idx > 0
+		idx0 = idx - 1
+
+		window_size_0 = v0 * self.irr_times[idx0]
+		window_size_1 = v1 * self.irr_times[idx]
+
+		if window_size_0 > self.max_window or window_size_1 > self.max_window:
+			return float('inf')
+		remaining_angle = self.angle_distances[idx0] - (window_size_0 + window_size_1) / 2
+		assert remaining_angle > 0
+
+		return self.duration(v0, v1, remaining_angle, self.elsts[idx0]) + self.irr_times[idx0]
+
+	def batch(self, idx, v0s, v1s):
+		"""
+		Costs of all edges from the velocities v0s in layer idx - 1 to the velocities v1s in layer idx, as an array of
+		shape (len(v0s), len(v1s)).
+
+		Pairs that violate the window size or the acceleration limits are set to infinity without calling the solver.
+		Without a jerk limit, all pairs are evaluated at once by the closed form solver.
+		"""
+		assert idx > 0
+		idx0 = idx - 1
+		v0s = np.asarray(v0s, dtype=float)
+		v1s = np.asarray(v1s, dtype=float)
+		irr_time_0 = self.irr_times[idx0]
+		irr_time_1 = self.irr_times[idx]
+
+		feasible = feasible_pairs(v0s, v1s, irr_time_0, irr_time_1, self.angle_distances[idx0], self.max_window, self.parameters)
+		costs = np.full(feasible.shape, float('inf'))
+		if self.stats is not None:
+			windows_fit = (v0s * irr_time_0 <= self.max_window)[:, None] & (v1s * irr_time_1 <= self.max_window)[None, :]
+			self.stats.edges_evaluated += int(np.count_nonzero(feasible))
+			self.stats.window_rejected += feasible.size - int(np.count_nonzero(windows_fit))
+			self.stats.kinematic_rejected += int(np.count_nonzero(windows_fit)) - int(np.count_nonzero(feasible))
+
+		elst = self.elsts[idx0]
+		if isinstance(self.solver, AccelerationLimitedSolver):
+			t0 = perf_counter()
+			remaining_angles = self.angle_distances[idx0] - (v0s[:, None] * irr_time_0 + v1s[None, :] * irr_time_1) / 2
+			durations = self.solver.durations(v0s[:, None], v1s[None, :], remaining_angles, elst)
+			costs[feasible] = durations[feasible] + irr_time_0
+			if self.stats is not None:
+				self.stats.seconds["edge_costs"] += perf_counter() - t0
+				self.stats.solver_calls += int(np.count_nonzero(feasible))
+				self.stats.infeasible_edges += int(np.count_nonzero(feasible & ~np.isfinite(durations)))
+			return costs
+
+		duration = self.duration
+		for i, j in zip(*np.nonzero(feasible)):
+			v0 = float(v0s[i])
+			v1 = float(v1s[j])
+			remaining_angle = self.angle_distances[idx0] - (v0 * irr_time_0 + v1 * irr_time_1) / 2
+			costs[i, j] = duration(v0, v1, remaining_angle, elst) + irr_time_0
+		return costs
+
+
+class CostBlockPrefetcher():
+	"""
+	Computes the cost blocks of the layer transitions in a process pool, ahead of their use by the search.
+
+	The block of transition idx holds the costs from all velocities disc_vels[vel_idx_begin[idx - 1]:vel_idx_end[idx - 1]]
+	in layer idx - 1 to all velocities disc_vels[vel_idx_begin[idx]:vel_idx_end[idx]] in layer idx. Every task computes chunksize consecutive blocks,
+	and blocks up to lookahead transitions beyond the last requested one are submitted in advance. Blocks are kept
+	until release() is called, so for large vel_res the memory use is roughly n * vel_res^2 * 8 bytes.
+	"""
+	def __init__(self, irr_times, elsts, angle_distances, max_window, parameters, disc_vels, vel_idx_begin, vel_idx_end, workers, chunksize=1, lookahead=None):
+		assert workers > 0
+		assert chunksize > 0
+		self.n = len(irr_times)
+		self.chunksize = chunksize
+		self.lookahead = lookahead if lookahead is not None else 2 * workers * chunksize
+		self.executor = ProcessPoolExecutor(max_workers=workers, initializer=init_cost_worker, initargs=(irr_times, elsts, angle_distances, max_window, parameters, disc_vels, vel_idx_begin, vel_idx_end))
+		self.futures = {}
+		self.blocks = {}
+		self.next_chunk_start = 1
+
+	def submit_until(self, idx):
+		while self.next_chunk_start <= min(idx, self.n - 1):
+			start = self.next_chunk_start
+			stop = min(start + self.chunksize, self.n)
+			self.futures[start] = self.executor.submit(cost_blocks, start, stop)
+			self.next_chunk_start = stop
+
+	def block(self, idx):
+		assert 0 < idx < self.n
+		if idx not in self.blocks:
+			self.submit_until(idx + self.lookahead)
+			start = 1 + ((idx - 1) // self.chunksize) * self.chunksize
+			for offset, block in enumerate(self.futures.pop(start).result()):
+				self.blocks[start + offset] = block
+		return self.blocks[idx]
+
+	def release(self, idx):
+		self.blocks.pop(idx, None)
+
+	def close(self):
+		self.executor.shutdown(wait=True, cancel_futures=True)
+		self.futures = {}
+		self.blocks = {}
+
+
+# The edge cost engine of a worker process in the pool of a CostBlockPrefetcher.
+worker_state = None
+
+
+def init_cost_worker(irr_times, elsts, angle_distances, max_window, parameters, disc_vels, vel_idx_begin, vel_idx_end):
+	global worker_state
+	worker_state = (EdgeCostEngine(irr_times, elsts, angle_distances, max_window, parameters), np.asarray(disc_vels), vel_idx_begin, vel_idx_end)
+
+
+def cost_blocks(start, stop):
+	engine, disc_vels, vel_idx_begin, vel_idx_end = worker_state
+	return [engine.batch(idx, disc_vels[vel_idx_begin[idx - 1]:vel_idx_end[idx - 1]], disc_vels[vel_idx_begin[idx]:vel_idx_end[idx]]) for idx in range(start, stop)]
+
+
+class EdgeCostCache():
+	"""
+	Cache of transition durations, keyed on (v0, v1, remaining_angle, elst, v_max, a_max, a_min, j_max).
+
+	The key values are rounded to multiples of quantum, so transitions that differ by less than that share one entry.
+	At most maxsize entries are kept in memory (least recently used are dropped first, None means no limit).
+
+	If path is given, the entries are also stored in an SQLite database at that path, so that they can be reused by
+	later runs and by other processes. The stored entries are loaded when the cache is opened; only if they do not all
+	fit in memory is the database queried on misses. Call flush() or close() (or use the cache as a context manager) to
+	make sure that everything is written.
+	"""
+	def __init__(self, maxsize=1000000, quantum=1.0e-9, path=None):
+		assert maxsize is None or maxsize > 0
+		assert quantum > 0
+		self.maxsize = maxsize
+		self.scale = 1.0 / quantum
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+		self.db = None
+		self.db_in_memory = True
+		self.pending = {}
+		if path is not None:
+			self.db = sqlite3.connect(path)
+			self.db.execute("CREATE TABLE IF NOT EXISTS edge_costs (key TEXT PRIMARY KEY, duration REAL) WITHOUT ROWID")
+			self.db.commit()
+			for key, duration in self.db.execute("SELECT key, duration FROM edge_costs"):
+				if maxsize is not None and len(self.entries) >= maxsize:
+					self.db_in_memory = False
+					break
+				self.entries[tuple(int(value) if value.lstrip("-").isdigit() else float(value) for value in key.split(","))] = duration
+
+	def key(self, *values):
+		scale = self.scale
+		return tuple(round(value * scale) if isfinite(value) else value for value in values)
+
+	def edge_key(self, v0, v1, remaining_angle, elst):
+		# Same as key(), but without the generic loop, since this is called for every edge.
+		scale = self.scale
+		return (round(v0 * scale), round(v1 * scale), round(remaining_angle * scale), round(elst * scale))
+
+	def get(self, key):
+		duration = self.entries.get(key)
+		if duration is not None:
+			self.entries.move_to_end(key)
+			self.hits += 1
+			return duration
+
+		if not self.db_in_memory and self.db is not None:
+			# Entries that are not written yet are looked up in memory, so that nothing is written, and the database not
+			# locked for other processes, before flush().
+			duration = self.pending.get(key)
+			if duration is None:
+				row = self.db.execute("SELECT duration FROM edge_costs WHERE key = ?", (db_key(key),)).fetchone()
+				duration = None if row is None else row[0]
+			if duration is not None:
+				self.hits += 1
+				self.remember(key, duration)
+				return duration
+
+		self.misses += 1
+		return None
+
+	def put(self, key, duration):
+		self.remember(key, duration)
+		if self.db is not None:
+			self.pending[key] = duration
+			if len(self.pending) >= 10000:
+				self.flush()
+
+	def remember(self, key, duration):
+		self.entries[key] = duration
+		if self.maxsize is not None and len(self.entries) > self.maxsize:
+			self.entries.popitem(last=False)
+			# Only with a database can the dropped entries be looked up again.
+			if self.db is not None:
+				self.db_in_memory = False
+
+	def flush(self):
+		if self.db is not None and len(self.pending) > 0:
+			self.db.executemany("INSERT OR REPLACE INTO edge_costs VALUES (?, ?)", [(db_key(key), duration) for key, duration in self.pending.items()])
+			self.db.commit()
+			self.pending = {}
+
+	def close(self):
+		self.flush()
+		if self.db is not None:
+			self.db.close()
+			self.db = None
+
+	def __len__(self):
+		return len(self.entries)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+
+def db_key(key):
+	return ",".join(str(value) for value in key)
+
+
+def feasible_pairs(v0s, v1s, irr_time_0, irr_time_1, angle_distance, max_window, parameters):
+	"""
+	Boolean array of shape (len(v0s), len(v1s)) that marks the velocity pairs that satisfy the window size and the
+	(acceleration limited) reachability bound that atom() uses to prune neighbours.
+	"""
+	half_windows_0 = v0s * irr_time_0 * 0.5
+	dist = angle_distance - half_windows_0
+	# Where the window is wider than the layer spacing, the distance is negative, and no velocity is reachable.
+	max_vel_square = 2 * parameters["a_max"] * dist + v0s * v0s
+	local_max_vel = np.sqrt(np.maximum(max_vel_square, 0.0))
+	min_vel_square = 2 * parameters["a_min"] * dist + v0s * v0s
+	local_min_vel = np.sqrt(np.maximum(min_vel_square, 0.0))
+
+	feasible = (v1s[None, :] <= local_max_vel[:, None]) & (v1s[None, :] >= local_min_vel[:, None])
+	feasible &= (max_vel_square >= 0)[:, None]
+	feasible &= (v0s * irr_time_0 <= max_window)[:, None]
+	feasible &= (v1s * irr_time_1 <= max_window)[None, :]
+	return feasible
@@ -0,0 +1,95 @@
+"""
+Fast estimate of the delivery time, with bounds and gradients, for use as an objective inside plan optimisation.
+"""
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from ATOM import SearchProblem, check_input, solve, surrogate_problem, surrogate_trajectory
+
+Estimate = namedtuple("Estimate", ["delivery_time", "lower_bound", "gap", "bound", "vels", "d_irr_times", "d_elsts", "seconds"])
+
+
+def layer_lower_bound(irr_times, elsts, angle_distances, parameters):
+	# The time from the middle of one layer to the middle of the next is at least half of both irradiation times plus
+	# the energy layer switching time, and at least the time to cover the angle between them at the maximum velocity.
+	irr_times = np.asarray(irr_times, dtype=float)
+	half_layers = (irr_times[:-1] + irr_times[1:]) / 2
+	between = np.maximum(half_layers + np.asarray(elsts, dtype=float), np.asarray(angle_distances, dtype=float) / parameters["v_max"])
+	return float((irr_times[0] + irr_times[-1]) / 2 + np.sum(between))
+
+
+def path_delivery_time(edge_costs, irr_times, vels):
+	# The delivery time of the trajectory with the layer velocities vels, with the costs of edge_costs.
+	return sum(edge_costs.cost(i, vels[i - 1], vels[i]) for i in range(1, len(vels))) + irr_times[-1]
+
+
+def path_gradients(edge_costs, irr_times, elsts, angle_distances, vels, angle_step=1.0e-4):
+	"""
+	Derivatives of the delivery time of the trajectory with the layer velocities vels, with respect to every irradiation
+	time and energy layer switching time, for fixed velocities.
+
+	A movement whose duration is the energy layer switching time (the active constraint) only depends on that, and
+	otherwise only on the remaining angle between the windows, which shrinks by v / 2 per second of irradiation time of
+	either layer. The derivative with respect to the remaining angle is a finite difference.
+	"""
+	n = len(irr_times)
+	d_irr_times = [1.0] * n
+	d_elsts = [0.0] * (n - 1)
+	for i in range(n - 1):
+		v0 = vels[i]
+		v1 = vels[i + 1]
+		remaining_angle = angle_distances[i] - (v0 * irr_times[i] + v1 * irr_times[i + 1]) / 2
+		duration = edge_costs.duration(v0, v1, remaining_angle, elsts[i])
+		if duration <= elsts[i] * (1 + 1.0e-9):
+			d_elsts[i] = 1.0
+			continue
+		longer = edge_costs.duration(v0, v1, remaining_angle + angle_step, elsts[i])
+		shorter = edge_costs.duration(v0, v1, remaining_angle - angle_step, elsts[i])
+		if shorter == float('inf'):
+			d_angle = (longer - duration) / angle_step
+		else:
+			d_angle = (longer - shorter) / (2 * angle_step)
+		d_irr_times[i] -= d_angle * v0 / 2
+		d_irr_times[i + 1] -= d_angle * v1 / 2
+	return d_irr_times, d_elsts
+
+
+def atom_estimate(irr_times, elsts, angle_distances, maximum_window_size, parameters, vel_res=256, stride=5, lower_bound=False, band=2):
+	"""
+	Estimates atom(..., vel_res) in a fraction of the time.
+
+	The layer velocities are chosen by ATOM.surrogate_trajectory(), with dynamic programming over every stride-th
+	velocity of the grid of atom() (stride has to divide vel_res - 1) and SurrogateCosts instead of Ruckig, refined with
+	the actual machine within band velocities of the grid of atom(). Their delivery time is an upper bound on the result
+	of atom().
+
+	The lower bound on the result of atom() is by default the one of layer_lower_bound(), which takes no time but
+	ignores the accelerations, so it is far below atom() when the gantry has to speed up and slow down a lot. With
+	lower_bound, the problem with the lower bounds of TransitionLowerBound is solved on the full grid instead, which
+	gives a bound within a few percent of atom(), but takes several times longer than the estimate itself.
+
+	Returns an Estimate, where bound is the lower bound that was used, "layers" or "relaxed", and gap the delivery time
+	minus the lower bound, so that the result of atom() is within gap below the estimate. It also has the derivatives
+	of the delivery time of the estimated trajectory with respect to the irradiation times and energy layer switching
+	times (see path_gradients()).
+	"""
+	check_input(irr_times, elsts, angle_distances, maximum_window_size, parameters, vel_res)
+	assert (vel_res - 1) % stride == 0, "stride has to divide vel_res - 1"
+	t0 = time.perf_counter()
+	problem = SearchProblem(irr_times, elsts, angle_distances, maximum_window_size, parameters, vel_res)
+	trajectory = surrogate_trajectory(problem, (vel_res - 1) // stride + 1, band)
+	if trajectory is None:
+		return Estimate(float('inf'), float('inf'), float('inf'), "relaxed" if lower_bound else "layers", None, None, None, time.perf_counter() - t0)
+	v_idxs, cost = trajectory
+	vels = problem.velocity_profile(v_idxs)
+	delivery_time = cost + irr_times[-1]
+
+	if lower_bound:
+		bound, _ = solve(surrogate_problem(irr_times, elsts, angle_distances, maximum_window_size, parameters, vel_res, True), "dp")
+	else:
+		bound = layer_lower_bound(irr_times, elsts, angle_distances, parameters)
+
+	d_irr_times, d_elsts = path_gradients(problem.edge_costs, irr_times, elsts, angle_distances, vels)
+	return Estimate(delivery_time, bound, delivery_time - bound, "relaxed" if lower_bound else "layers", vels, d_irr_times, d_elsts, time.perf_counter() - t0)
@@ -4,6 +4,8 @@ Script to calculate the delivery time of a dynamic proton arc plan from RayStati
 Note that these plans are currently (June 2023) not clinically supported, and a special research build is required.
 
 This script might take 1-5 min, depending on the plan. Patience is a virtue. Or so I've heard.
+With WORKERS > 1, the arcs of all beams are optimized in parallel, so with enough CPU cores it takes about as long as the
+slowest arc.
 """
 
 
@@ -15,7 +17,7 @@ This script might take 1-5 min, depending on the plan. Patience is a virtue. Or
 # NOTE: Make sure that the maximum window size is smaller than the angular spacing between 
 MAX_WINDOW_SIZE = 0.99  # TODO: In the future this value will be read automatically from RayStation. 
 
-# Maximum velocity, acceleration and jerk of the gantry.
+# Maximum velocity, acceleration and jerk of the gantry. Use JERK_MAX = float('inf') for an acceleration limited gantry.
 VEL_MAX = 5.0
 ACC_MAX = 0.5
 JERK_MAX = 0.5
@@ -23,6 +25,11 @@ JERK_MAX = 0.5
 # Energy switching times
 DOWN_SWITCH_TIME = 0.5
 UP_SWITCH_TIME = 5.0
+# Energy dependent switching times can be given by a table instead (e.g. "switch_times.csv", see ATOM_switch_times.py),
+# which replaces the two times above.
+SWITCH_TIME_TABLE = None
+# Switching times are rounded up to multiples of this (e.g. 0.1) if it is given, which makes edge cost tables smaller.
+SWITCH_TIME_QUANTUM = None
 
 # Irradiation times
 TIME_PER_SPOT_SWITCH = 0.002
@@ -32,98 +39,72 @@ SPOT_DELIVERY_S_PER_MU = 0.005
 #Higher value gives more accurate result, but increases calculation time.
 VEL_RES = 256
 
+# Edge costs are cached between runs if a file is given here (e.g. "atom_edge_costs.sqlite").
+EDGE_COST_CACHE_FILE = None
+
+# If a file is given here (e.g. "plans.jsonl"), the arcs are also appended to it as plans (see ATOM_plan.py), so that they
+# can be scored again later with ATOM_cli.py, without RayStation.
+EXPORT_FILE = None
+
+# Number of processes that optimize the arcs of the beams in parallel. 1 optimizes them one by one in the scripting
+# environment itself. Only increase it (None means one per CPU core) if the scripting environment allows starting new
+# Python processes.
+WORKERS = 1
+
 #########################################################################
 # END OF PARAMETERS!
 # Thanks for your attention (:
 #########################################################################
 
-from ATOM import atom
+from ATOM import atom_batch
+from ATOM_plan import append_plans, make_plan
+from ATOM_preprocess import beam_arcs
+from ATOM_switch_times import UpDownSwitchTime, load_switch_time_table
 
 from connect import *
 
 
-def calculate_spot_scanning_time(beamMU, segment):
-	# Constant delivery rate
-	totalTime = 0
-	for w in segment.Spots.Weights:
-		spotMu = beamMU * w
-		spot_time = SPOT_DELIVERY_S_PER_MU * spotMu
-		totalTime += spot_time
-
-	return totalTime
-
-
-def calculat_spot_switching_time(segment):
-	# Constant spot switching time
-	numberOfSpots = len(segment.Spots.Weights)
-	numberOfSpotSwitches = numberOfSpots - 1 if numberOfSpots > 0 else 0
-	return TIME_PER_SPOT_SWITCH * numberOfSpotSwitches
-
-
-def estimate_switch_time(fromNrj, toNrj):
-	# Constant up-switching time & constant down-switching
-	if abs(fromNrj - toNrj) < 1.0e-8:
-		return 0.0
-	elif fromNrj < toNrj:
-		return UP_SWITCH_TIME
-	else:
-		return DOWN_SWITCH_TIME
-
-
-plan = get_current("Plan")
-
-beams = list(get_current("BeamSet").Beams)[:]
-parameters = {"v_max": VEL_MAX, "a_max": ACC_MAX, "a_min": -ACC_MAX, "j_max": JERK_MAX}
-
-total_time = 0.0
-for b in range(len(beams)):
-	total_beam_time = 0.0
-	n = len(beams[b].Segments)
-
-	nrjs = [beams[b].Segments[i].NominalEnergy for i in range(n)]
-
-	elsts = [estimate_switch_time(nrjs[i], nrjs[i+1]) for i in range(len(nrjs)-1)]
-	irr_times = [calculate_spot_scanning_time(beams[b].BeamMU, beams[b].Segments[i]) + calculat_spot_switching_time(beams[b].Segments[i]) for i in range(n)]
-
-	angles = [beams[b].Segments[i].IonArcSegmentProperties.DeltaGantryAngle for i in range(n)]
-	for i in range(len(angles)):
-		while angles[i] >= 360:
-			angles[i] -= 360.0
-		while angles[i] < 0:
-			angles[i] += 360.0	
-
-	angle_distances = [min(abs(angles[i] - angles[i+1]), abs(360-abs(angles[i] - angles[i+1]))) for i in range(len(angles) - 1)]
-	assert max(angle_distances) < 180  # We don't support this case.
-	assert len(angle_distances) > 2
-	direction_change = [False] + [beams[b].Segments[i].IonArcSegmentProperties.RotationDirection != beams[b].Segments[i-1].IonArcSegmentProperties.RotationDirection for i in range(1, n)]
-	should_be_still_list = [False] * (1 + len(angles))
-	for i in range(len(angle_distances)):
-		if i < len(direction_change) and direction_change[i]:
-			should_be_still_list[i] = True
-	should_be_still_list[-1] = True
-
-	current_start_idx = 0
-	all_vels = []
-	while True in should_be_still_list:
-		end_idx = should_be_still_list.index(True)
-		should_be_still_list[should_be_still_list.index(True)] = False
-
-		irr_times_local = irr_times[current_start_idx:end_idx]
-		elsts_local = elsts[current_start_idx:end_idx - 1]
-
-		# NOTE: In multirevolution cases, the algorithm will assume that the gantry will teleport between the end of one revolution and the start of the other.
-		#       This should be fine, since they should be the same.
-		angle_distances_local = angle_distances[current_start_idx:end_idx - 1]
-		
-		elst_that_fall_between_arcs = 0.0 if end_idx > len(elsts) else elsts[end_idx - 1] 
-		delivery_time, vels = atom(irr_times_local, elsts_local, angle_distances_local, MAX_WINDOW_SIZE, parameters, VEL_RES)
-		
-		total_beam_time += delivery_time + elst_that_fall_between_arcs
-		assert len(vels) == len(irr_times_local)
-		all_vels = all_vels + vels
-		current_start_idx = end_idx
-		all_vels = all_vels + vels
-
-	total_time += total_beam_time
-	print("TOTAL TIME: ", round(total_beam_time, 3), "[s] for beam", b+1)
-print("TOTAL TIME: ", round(total_time, 3), "(assuming that there is no travel time between the beams).")
+def main():
+	plan = get_current("Plan")
+
+	beams = list(get_current("BeamSet").Beams)[:]
+	parameters = {"v_max": VEL_MAX, "a_max": ACC_MAX, "a_min": -ACC_MAX, "j_max": JERK_MAX}
+	switch_time_model = UpDownSwitchTime(UP_SWITCH_TIME, DOWN_SWITCH_TIME) if SWITCH_TIME_TABLE is None else load_switch_time_table(SWITCH_TIME_TABLE)
+
+	# All arcs of all beams are collected first, and then solved at the same time.
+	problems = []
+	names = []
+	arcs_of_beam = []
+	for b in range(len(beams)):
+		arcs = []
+		for arc in beam_arcs(beams[b], SPOT_DELIVERY_S_PER_MU, TIME_PER_SPOT_SWITCH, switch_time_model, SWITCH_TIME_QUANTUM):
+			# NOTE: In multirevolution cases, the algorithm will assume that the gantry will teleport between the end of one revolution and the start of the other.
+			#       This should be fine, since they should be the same.
+			arcs.append((len(problems), arc.elst_after))
+			names.append("%s beam %d arc %d" % (plan.Name, b + 1, len(arcs)))
+			problems.append({"irr_times": arc.irr_times, "elsts": arc.elsts, "angle_distances": arc.angle_distances, "maximum_window_size": MAX_WINDOW_SIZE, "parameters": parameters, "vel_res": VEL_RES})
+		arcs_of_beam.append(arcs)
+
+	if EXPORT_FILE is not None:
+		append_plans(EXPORT_FILE, [make_plan(name=names[i], **{key: value for key, value in problems[i].items() if key != "vel_res"}) for i in range(len(problems))])
+
+	results = atom_batch(problems, workers=WORKERS, cache_file=EDGE_COST_CACHE_FILE)
+
+	total_time = 0.0
+	for b in range(len(beams)):
+		total_beam_time = 0.0
+		all_vels = []
+		for problem_idx, elst_that_fall_between_arcs in arcs_of_beam[b]:
+			result = results[problem_idx]
+			total_beam_time += result.delivery_time + elst_that_fall_between_arcs
+			assert len(result.vels) == len(problems[problem_idx]["irr_times"])
+			all_vels = all_vels + result.vels
+			print("Arc with", len(result.vels), "layers of beam", b+1, "took", round(result.seconds, 1), "s to optimize.")
+
+		total_time += total_beam_time
+		print("TOTAL TIME: ", round(total_beam_time, 3), "[s] for beam", b+1)
+	print("TOTAL TIME: ", round(total_time, 3), "(assuming that there is no travel time between the beams).")
+
+
+if __name__ == '__main__':
+	main()
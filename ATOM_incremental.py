@@ -0,0 +1,121 @@
+"""
+Incremental re-optimisation, for using the delivery time inside an optimisation loop where only a few layers of a plan
+change at a time.
+"""
+import numpy as np
+
+from ATOM import SearchProblem, check_input
+
+
+class IncrementalATOM():
+	"""
+	Keeps the edge costs of every layer transition and the dynamic programming values of a solved arc, such that the
+	delivery time can be updated cheaply when the irradiation times or the energy layer switching times of a few layers
+	change.
+
+	forward[i] holds the shortest time from the first layer to every state of layer i, and backward[i] the shortest time
+	from every state of layer i to the last layer. Forward values are valid up to layer forward_valid, and backward values
+	from layer backward_valid on. A change of layer k invalidates the costs of the transitions into and out of k, so
+	only those are recomputed, and the forward and backward values are extended until they meet in between.
+
+	Memory grows with n * vel_res^2, since all cost blocks are kept.
+	"""
+	def __init__(self, irr_times, elsts, angle_distances, maximum_window_size, parameters, vel_res=256, cache=None):
+		check_input(irr_times, elsts, angle_distances, maximum_window_size, parameters, vel_res)
+		self.irr_times = list(irr_times)
+		self.elsts = list(elsts)
+		self.angle_distances = angle_distances
+		self.maximum_window_size = maximum_window_size
+		self.parameters = parameters
+		self.vel_res = vel_res
+		self.cache = cache
+		n = len(irr_times)
+		self.n = n
+
+		# The costs of transition t, from layer t - 1 to layer t, are stored in blocks[t].
+		self.blocks = [None] * n
+		self.stale = set(range(1, n))
+		self.forward = [None] * n
+		self.backward = [None] * n
+		self.pred = np.zeros((n, vel_res), dtype=np.int32)
+		self.succ = np.zeros((n, vel_res), dtype=np.int32)
+		self.forward[0] = np.full(vel_res, float('inf'))
+		self.forward[0][0] = 0.0
+		self.backward[n - 1] = np.full(vel_res, float('inf'))
+		self.backward[n - 1][0] = 0.0
+		self.forward_valid = 0
+		self.backward_valid = n - 1
+		self.recomputed_transitions = 0
+
+	def update(self, irr_times=None, elsts=None):
+		"""
+		Replaces the irradiation times and/or energy layer switching times, and returns the new (delivery time,
+		velocities) like solve(). Only the layers whose values actually differ are recomputed.
+		"""
+		if irr_times is not None:
+			assert len(irr_times) == self.n
+			for k in range(self.n):
+				if irr_times[k] != self.irr_times[k]:
+					self.invalidate_transitions(max(k, 1), min(k + 1, self.n - 1))
+			self.irr_times = list(irr_times)
+		if elsts is not None:
+			assert len(elsts) == self.n - 1
+			for k in range(self.n - 1):
+				if elsts[k] != self.elsts[k]:
+					self.invalidate_transitions(k + 1, k + 1)
+			self.elsts = list(elsts)
+		check_input(self.irr_times, self.elsts, self.angle_distances, self.maximum_window_size, self.parameters, self.vel_res)
+		return self.solve()
+
+	def invalidate_transitions(self, first, last):
+		self.stale.update(range(first, last + 1))
+		self.forward_valid = min(self.forward_valid, first - 1)
+		self.backward_valid = max(self.backward_valid, last)
+
+	def solve(self):
+		# Returns (float('inf'), None) if there is no feasible trajectory.
+		n = self.n
+		problem = SearchProblem(self.irr_times, self.elsts, self.angle_distances, self.maximum_window_size, self.parameters, self.vel_res, self.cache)
+		disc_vels = np.asarray(problem.disc_vels)
+		# The reachability envelope of a layer depends on all the others, so the blocks cover the window limited ranges.
+		begin = problem.allowed_vel_idx_begin
+		end = problem.allowed_vel_idx_end
+		for t in sorted(self.stale):
+			self.blocks[t] = problem.edge_costs.batch(t, disc_vels[begin[t - 1]:end[t - 1]], disc_vels[begin[t]:end[t]])
+			self.recomputed_transitions += 1
+		self.stale.clear()
+
+		# The frontiers meet in the middle of the invalidated layers, which is the changed layer itself if there is only one.
+		# Costs of further changes close to it are then small on either side.
+		if self.forward_valid < self.backward_valid:
+			meet = (self.forward_valid + self.backward_valid) // 2
+			for i in range(self.forward_valid + 1, meet + 1):
+				total = self.forward[i - 1][begin[i - 1]:end[i - 1]][:, None] + self.blocks[i]
+				self.forward[i] = np.full(self.vel_res, float('inf'))
+				if total.size > 0:
+					best = np.argmin(total, axis=0)
+					self.forward[i][begin[i]:end[i]] = total[best, np.arange(total.shape[1])]
+					self.pred[i, begin[i]:end[i]] = begin[i - 1] + best
+			for i in range(self.backward_valid - 1, meet - 1, -1):
+				total = self.blocks[i + 1] + self.backward[i + 1][begin[i + 1]:end[i + 1]][None, :]
+				self.backward[i] = np.full(self.vel_res, float('inf'))
+				if total.size > 0:
+					best = np.argmin(total, axis=1)
+					self.backward[i][begin[i]:end[i]] = total[np.arange(total.shape[0]), best]
+					self.succ[i, begin[i]:end[i]] = begin[i + 1] + best
+			self.forward_valid = self.backward_valid = meet
+
+		meet = self.backward_valid
+		totals = self.forward[meet] + self.backward[meet]
+		v_idx = int(np.argmin(totals))
+		if totals[v_idx] == float('inf'):
+			return float('inf'), None
+		time_val = float(totals[v_idx]) + self.irr_times[-1]
+
+		v_idxs = [v_idx]
+		for i in range(meet, 0, -1):
+			v_idxs.append(int(self.pred[i, v_idxs[-1]]))
+		v_idxs.reverse()
+		for i in range(meet, n - 1):
+			v_idxs.append(int(self.succ[i, v_idxs[-1]]))
+		return time_val, problem.velocity_profile(v_idxs)
@@ -0,0 +1,108 @@
+"""
+Plan files: the input of atom() for one arc, so that plans can be exported once and scored without RayStation.
+
+A plan is a dict with the keyword arguments irr_times, elsts, angle_distances, maximum_window_size and parameters of
+atom() (as for atom_batch), and a name. It is stored as
+- .json: one JSON object with these keys,
+- .npz: the arrays irr_times, elsts and angle_distances, and the scalars maximum_window_size, name and v_max, a_max,
+  a_min, j_max of the parameters,
+- .jsonl: one JSON object per line, for many plans in one file.
+An infinite j_max is written as Infinity in JSON, as Python's json module does.
+"""
+import json
+import os
+from functools import partial
+
+import numpy as np
+
+from ATOM import check_input
+
+PARAMETER_NAMES = ("v_max", "a_max", "a_min", "j_max")
+PLAN_EXTENSIONS = (".json", ".npz")
+
+
+def make_plan(irr_times, elsts, angle_distances, maximum_window_size, parameters, name=""):
+	plan = {
+		"name": str(name),
+		"irr_times": [float(t) for t in irr_times],
+		"elsts": [float(t) for t in elsts],
+		"angle_distances": [float(d) for d in angle_distances],
+		"maximum_window_size": float(maximum_window_size),
+		"parameters": {key: float(parameters[key]) for key in PARAMETER_NAMES}}
+	check_input(plan["irr_times"], plan["elsts"], plan["angle_distances"], plan["maximum_window_size"], plan["parameters"], 2)
+	return plan
+
+
+def plan_from_dict(d, name=""):
+	return make_plan(d["irr_times"], d["elsts"], d["angle_distances"], d["maximum_window_size"], d["parameters"], d.get("name", name))
+
+
+def plan_problem(plan):
+	# The keyword arguments of atom() in the plan.
+	return {key: value for key, value in plan.items() if key != "name"}
+
+
+def save_plan(path, plan):
+	if path.endswith(".npz"):
+		np.savez(path, irr_times=plan["irr_times"], elsts=plan["elsts"], angle_distances=plan["angle_distances"], maximum_window_size=plan["maximum_window_size"], name=plan["name"], **plan["parameters"])
+	else:
+		with open(path, "w") as f:
+			json.dump(plan, f)
+
+
+def load_plan(path):
+	# The name defaults to the file name without the extension.
+	name = os.path.splitext(os.path.basename(path))[0]
+	if path.endswith(".npz"):
+		with np.load(path) as data:
+			parameters = {key: float(data[key]) for key in PARAMETER_NAMES}
+			return make_plan(data["irr_times"], data["elsts"], data["angle_distances"], float(data["maximum_window_size"]), parameters, str(data["name"]) or name)
+	with open(path) as f:
+		return plan_from_dict(json.load(f), name)
+
+
+def append_plans(path, plans):
+	# Appends the plans to a .jsonl file.
+	with open(path, "a") as f:
+		for plan in plans:
+			f.write(json.dumps(plan) + "\n")
+
+
+def iter_plans(source, on_error=None):
+	"""
+	Generates the plans in source, which is a directory (of .json and .npz files, in sorted order), a .jsonl file or a
+	single plan file. The plans are read one at a time, so that the source can be larger than the memory. Plans in
+	a .jsonl file without a name are named after the file and the line number.
+
+	If on_error is given, plans that can not be read or are invalid are skipped after calling on_error(name, exception).
+	"""
+	if os.path.isdir(source):
+		readers = ((os.path.splitext(file_name)[0], partial(load_plan, os.path.join(source, file_name))) for file_name in sorted(os.listdir(source)) if file_name.endswith(PLAN_EXTENSIONS))
+	elif source.endswith(".jsonl"):
+		readers = jsonl_readers(source)
+	else:
+		readers = [(os.path.splitext(os.path.basename(source))[0], partial(load_plan, source))]
+	for name, read in readers:
+		if on_error is None:
+			yield read()
+			continue
+		try:
+			plan = read()
+		except (AssertionError, KeyError, TypeError, ValueError, OSError) as e:
+			on_error(name, e)
+			continue
+		yield plan
+
+
+def jsonl_readers(path):
+	# (name, function that reads the plan) for every line of a .jsonl file.
+	base = os.path.splitext(os.path.basename(path))[0]
+	with open(path) as f:
+		for line_number, line in enumerate(f, 1):
+			if line.strip():
+				name = "%s:%d" % (base, line_number)
+				yield name, partial(plan_from_line, line, name)
+
+
+def plan_from_line(line, name):
+	return plan_from_dict(json.loads(line), name)
@@ -0,0 +1,82 @@
+"""
+The inputs of ATOM for the arcs of a RayStation beam set, computed with NumPy.
+
+The segment data is read once per beam into arrays (extract_beam), since every attribute access of a RayStation object
+goes through the scripting interface. Only the attributes that ATOM_from_RS.py used are read, so any objects with the
+same attributes work too, such as the ones that beam_from_arrays() makes for testing without RayStation.
+"""
+from collections import namedtuple
+from types import SimpleNamespace
+
+import numpy as np
+
+from ATOM_switch_times import switch_times
+
+BeamData = namedtuple("BeamData", ["beam_mu", "energies", "gantry_angles", "rotation_directions", "spot_weights", "spot_counts"])
+Arc = namedtuple("Arc", ["irr_times", "elsts", "angle_distances", "elst_after"])
+
+
+def extract_beam(beam):
+	# spot_weights are the weights of all segments after each other, spot_counts the number of spots per segment.
+	segments = list(beam.Segments)
+	weights = [segment.Spots.Weights for segment in segments]
+	spot_counts = np.array([len(w) for w in weights], dtype=int)
+	spot_weights = np.fromiter((w for segment_weights in weights for w in segment_weights), dtype=float, count=int(spot_counts.sum()))
+	properties = [segment.IonArcSegmentProperties for segment in segments]
+	return BeamData(
+		float(beam.BeamMU),
+		np.array([segment.NominalEnergy for segment in segments], dtype=float),
+		np.array([p.DeltaGantryAngle for p in properties], dtype=float),
+		np.array([str(p.RotationDirection) for p in properties]),
+		spot_weights,
+		spot_counts)
+
+
+def irradiation_times(beam_data, spot_delivery_s_per_mu, time_per_spot_switch):
+	# Constant delivery rate and constant spot switching time.
+	segment_ids = np.repeat(np.arange(len(beam_data.spot_counts)), beam_data.spot_counts)
+	weight_sums = np.bincount(segment_ids, weights=beam_data.spot_weights, minlength=len(beam_data.spot_counts))
+	return spot_delivery_s_per_mu * beam_data.beam_mu * weight_sums + time_per_spot_switch * np.maximum(beam_data.spot_counts - 1, 0)
+
+
+def angle_distances(gantry_angles):
+	# The distances between consecutive gantry angles, in either direction, so at most 180 degrees.
+	distances = np.abs(np.diff(np.mod(gantry_angles, 360.0)))
+	return np.minimum(distances, 360.0 - distances)
+
+
+def split_arcs(irr_times, elsts, distances, rotation_directions):
+	"""
+	Splits a beam into arcs, where the rotation direction changes and the gantry stands still. Returns a list of Arcs,
+	where elst_after is the energy layer switching time between the arc and the next one (0 after the last one). A
+	direction change at the last layer is ignored, since that layer can not be an arc of its own.
+	"""
+	n = len(irr_times)
+	changes = np.flatnonzero(rotation_directions[1:n - 1] != rotation_directions[:n - 2]) + 1
+	starts = np.concatenate(([0], changes))
+	ends = np.concatenate((changes, [n]))
+	return [Arc(irr_times[start:end].tolist(), elsts[start:end - 1].tolist(), distances[start:end - 1].tolist(), 0.0 if end == n else float(elsts[end - 1])) for start, end in zip(starts, ends)]
+
+
+def beam_arcs(beam, spot_delivery_s_per_mu, time_per_spot_switch, switch_time_model, switch_time_quantum=None):
+	# The energy layer switching times are given by an ATOM_switch_times model, see switch_times() there.
+	beam_data = extract_beam(beam)
+	distances = angle_distances(beam_data.gantry_angles)
+	assert np.max(distances) < 180  # We don't support this case.
+	assert len(distances) > 2
+	irr_times = irradiation_times(beam_data, spot_delivery_s_per_mu, time_per_spot_switch)
+	elsts = switch_times(beam_data.energies, switch_time_model, switch_time_quantum)
+	return split_arcs(irr_times, elsts, distances, beam_data.rotation_directions)
+
+
+def beam_from_arrays(beam_mu, energies, gantry_angles, rotation_directions, spot_weights):
+	"""
+	An object with the attributes of a RayStation beam that the functions above read, for running them without
+	RayStation. spot_weights has one sequence of weights per segment.
+	"""
+	segments = [SimpleNamespace(
+		NominalEnergy=energy,
+		Spots=SimpleNamespace(Weights=list(weights)),
+		IonArcSegmentProperties=SimpleNamespace(DeltaGantryAngle=angle, RotationDirection=direction))
+		for energy, angle, direction, weights in zip(energies, gantry_angles, rotation_directions, spot_weights)]
+	return SimpleNamespace(BeamMU=beam_mu, Segments=segments)
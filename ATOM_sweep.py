@@ -0,0 +1,228 @@
+"""
+Delivery times of a set of plans for a grid of machine parameters, e.g. to see how much faster a cohort would be
+delivered with another maximum jerk or velocity of the gantry.
+
+Usage: python ATOM_sweep.py plans.jsonl [--v-max 5 6] [--a-max 0.5] [--j-max 0.5 1.0] [--vel-res 256] [--workers 4]
+       [--table-angles 401] [--csv sweep.csv]
+"""
+import argparse
+import csv
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from ATOM import SearchProblem, astar_heuristic, atom, batch_problem_size, check_input, native_backend, relaxed_heuristics, solve
+from ATOM_cost_table import build_cost_table, load_cost_table
+from ATOM_plan import PARAMETER_NAMES, iter_plans, plan_problem
+
+SweepRow = namedtuple("SweepRow", ["plan", "v_max", "a_max", "a_min", "j_max", "delivery_time", "relative", "seconds"])
+
+
+def parameter_grid(base, **values):
+	"""
+	All combinations of the given values of the machine parameters, with the other parameters from base, e.g.
+	parameter_grid(parameters, j_max=[0.5, 1.0], v_max=[5.0, 6.0]). a_min defaults to -a_max when a_max is varied.
+	"""
+	assert all(key in PARAMETER_NAMES for key in values), "Unknown parameter"
+	keys = list(values)
+	grid = []
+	for combination in itertools.product(*(values[key] for key in keys)):
+		parameters = dict(base)
+		if "a_max" in keys and "a_min" not in keys:
+			parameters["a_min"] = -combination[keys.index("a_max")]
+		parameters.update(zip(keys, (float(value) for value in combination)))
+		grid.append(parameters)
+	return grid
+
+
+def table_grid(plans):
+	# The remaining angle range and switching times that a cost table needs to cover for the plans, or None if the
+	# layers of the plans are not all equally spaced by the same angle.
+	distances = {d for plan in plans for d in plan["angle_distances"]}
+	if len(distances) != 1:
+		return None
+	distance = distances.pop()
+	max_window = max(plan["maximum_window_size"] for plan in plans)
+	elsts = sorted({elst for plan in plans for elst in plan["elsts"]})
+	return distance - max_window, distance, elsts
+
+
+# The cost tables that a process has loaded, by path.
+sweep_tables = {}
+
+
+def sweep_table(table_path, mode):
+	if table_path is None:
+		return None
+	if table_path not in sweep_tables:
+		sweep_tables[table_path] = load_cost_table(table_path, mode)
+	return sweep_tables[table_path]
+
+
+def uses_native(problem, parameters, cost_table):
+	# Whether atom() would use the native backend, which sets up every problem itself.
+	backend = problem["backend"]
+	return backend == "native" or (backend == "auto" and native_backend(parameters, None, problem["method"], None, None, cost_table, None, None))
+
+
+def solve_sweep_task(problem, grid, table_paths, mode):
+	"""
+	Solves problem (the keyword arguments of atom() without parameters) with every parameters of grid, which only differ
+	in j_max. The Python backend shares the search graph (see SearchProblem.for_parameters()) and the heuristic sweep
+	(see relaxed_heuristics()) between them. Returns (delivery time, seconds) per parameters, where the shared set up
+	is split evenly.
+	"""
+	cost_tables = [sweep_table(path, mode) for path in table_paths]
+	results = [None] * len(grid)
+	shared = []
+	for k, parameters in enumerate(grid):
+		if uses_native(problem, parameters, cost_tables[k]):
+			t0 = time.perf_counter()
+			delivery_time, _ = atom(**problem, parameters=parameters, cost_table=cost_tables[k])
+			results[k] = (delivery_time, time.perf_counter() - t0)
+		else:
+			shared.append(k)
+	if len(shared) == 0:
+		return results
+
+	t0 = time.perf_counter()
+	for k in shared:
+		check_input(problem["irr_times"], problem["elsts"], problem["angle_distances"], problem["maximum_window_size"], grid[k], problem["vel_res"])
+	base = SearchProblem(problem["irr_times"], problem["elsts"], problem["angle_distances"], problem["maximum_window_size"], grid[shared[0]], problem["vel_res"], cost_table=cost_tables[shared[0]])
+	directions = {"astar": [False], "bidirectional": [False, True], "dp": []}[problem["method"]]
+	if base.heuristic == "switching":
+		for reverse in directions:
+			base.heuristics[reverse] = astar_heuristic(base, reverse)
+	problems = [base] + [base.for_parameters(grid[k], cost_table=cost_tables[k]) for k in shared[1:]]
+	if base.heuristic == "relaxed":
+		for reverse in directions:
+			for other, heuristic in zip(problems, relaxed_heuristics(problems, reverse)):
+				other.heuristics[reverse] = heuristic
+	setup = (time.perf_counter() - t0) / len(shared)
+	for k, other in zip(shared, problems):
+		t0 = time.perf_counter()
+		delivery_time, _ = solve(other, problem["method"])
+		assert delivery_time < float('inf')
+		results[k] = (delivery_time, setup + time.perf_counter() - t0)
+	return results
+
+
+def atom_sweep(plans, grid, vel_res=256, workers=None, method="astar", backend="auto", table_angles=None, table_mode="upper"):
+	"""
+	Solves every plan (see ATOM_plan.py) with every parameters of grid (see parameter_grid()) instead of its own, in
+	workers processes (None means one per core, 1 solves them in this process). Returns a list of SweepRows, one per
+	plan and parameters, where relative is the delivery time divided by the one with grid[0].
+
+	The plans are read and checked once for the whole grid. The parameters that only differ in j_max are solved in one
+	task per plan, which builds the search graph and the heuristic once for all of them with the Python backend (see
+	solve_sweep_task()). With table_angles, and layers that are equally spaced by
+	the same angle in all plans, the transition durations for every parameters are computed once for all plans in an
+	ATOM_cost_table.EdgeCostTable, with table_angles remaining angles, which the processes share through memory mapped
+	files. atom() then uses the Python implementation with table lookups (see ATOM_cost_table.py for their rounding),
+	which pays off for cohorts of more than a few dozen plans when the native backend is not available.
+	"""
+	plans = list(plans)
+	assert len(grid) > 0
+	table_dir = None
+	table_paths = [None] * len(grid)
+	coverage = None if table_angles is None else table_grid(plans)
+	try:
+		if coverage is not None:
+			table_dir = tempfile.mkdtemp(prefix="atom_sweep")
+			angle_min, angle_max, elsts = coverage
+			for g, parameters in enumerate(grid):
+				table = build_cost_table(parameters, vel_res, np.linspace(max(angle_min, 0.0), angle_max, table_angles), elsts, None if workers == 1 else workers or os.cpu_count(), table_mode)
+				table_paths[g] = os.path.join(table_dir, "table%d.npy" % g)
+				table.save(table_paths[g])
+
+		# One task per plan and v_max, a_max, a_min, which solves all j_max of these.
+		groups = {}
+		for g, parameters in enumerate(grid):
+			groups.setdefault((parameters["v_max"], parameters["a_max"], parameters["a_min"]), []).append(g)
+		tasks = [(p, group) for p in range(len(plans)) for group in groups.values()]
+		problems = [dict({key: value for key, value in plan_problem(plans[p]).items() if key != "parameters"}, vel_res=vel_res, method=method, backend=backend) for p, _ in tasks]
+		order = sorted(range(len(tasks)), key=lambda t: -batch_problem_size(problems[t]) * len(tasks[t][1]))
+		results = {}
+
+		def task_arguments(t):
+			group = tasks[t][1]
+			return problems[t], [grid[g] for g in group], [table_paths[g] for g in group], table_mode
+
+		def store(t, task_results):
+			p, group = tasks[t]
+			for g, result in zip(group, task_results):
+				results[p, g] = result
+
+		if workers == 1:
+			for t in order:
+				store(t, solve_sweep_task(*task_arguments(t)))
+			sweep_tables.clear()
+		else:
+			with ProcessPoolExecutor(max_workers=workers) as executor:
+				futures = {executor.submit(solve_sweep_task, *task_arguments(t)): t for t in order}
+				for future in as_completed(futures):
+					store(futures[future], future.result())
+	finally:
+		if table_dir is not None:
+			shutil.rmtree(table_dir)
+
+	rows = []
+	for p in range(len(plans)):
+		reference = results[p, 0][0]
+		for g, parameters in enumerate(grid):
+			delivery_time, seconds = results[p, g]
+			rows.append(SweepRow(plans[p]["name"], parameters["v_max"], parameters["a_max"], parameters["a_min"], parameters["j_max"], delivery_time, delivery_time / reference, seconds))
+	return rows
+
+
+def write_csv(path, rows):
+	with open(path, "w", newline="") as f:
+		writer = csv.writer(f)
+		writer.writerow(SweepRow._fields)
+		writer.writerows(rows)
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("source", help="Directory of .json and .npz plans, .jsonl file of plans, or a single plan.")
+	parser.add_argument("--v-max", type=float, nargs="+", help="Maximum velocities, by default the one of the first plan.")
+	parser.add_argument("--a-max", type=float, nargs="+", help="Maximum accelerations, a_min is -a_max.")
+	parser.add_argument("--j-max", type=float, nargs="+", help="Maximum jerks, inf selects the acceleration limited model.")
+	parser.add_argument("--vel-res", type=int, default=256, help="Number of discrete velocities.")
+	parser.add_argument("--workers", type=int, help="Number of processes, one per core by default.")
+	parser.add_argument("--backend", default="auto", choices=["auto", "python", "native"], help="Backend of atom().")
+	parser.add_argument("--table-angles", type=int, help="Share one cost table with this many remaining angles per parameters between the plans.")
+	parser.add_argument("--csv", help="Write the results to this CSV file.")
+	args = parser.parse_args()
+
+	errors = []
+
+	def on_error(name, e):
+		# Like ATOM_cli.py, plans that can not be read are reported and skipped.
+		errors.append(name)
+		print("%s: %s: %s" % (name, type(e).__name__, e), file=sys.stderr)
+
+	plans = list(iter_plans(args.source, on_error))
+	if len(plans) == 0:
+		sys.exit("No plans could be read from " + args.source)
+	values = {key: getattr(args, key) for key in ("v_max", "a_max", "j_max") if getattr(args, key) is not None}
+	grid = parameter_grid(plans[0]["parameters"], **values)
+	t0 = time.perf_counter()
+	rows = atom_sweep(plans, grid, args.vel_res, args.workers, backend=args.backend, table_angles=args.table_angles)
+	print("%d plans (%d skipped), %d parameters in %.1f s" % (len(plans), len(errors), len(grid), time.perf_counter() - t0))
+	for g, parameters in enumerate(grid):
+		relative = [row.relative for row in rows[g::len(grid)]]
+		print("%s: mean relative delivery time %.4f (min %.4f, max %.4f)" % (", ".join("%s %g" % item for item in parameters.items()), np.mean(relative), np.min(relative), np.max(relative)))
+	if args.csv is not None:
+		write_csv(args.csv, rows)
+
+
+if __name__ == '__main__':
+	main()
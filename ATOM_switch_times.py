@@ -0,0 +1,113 @@
+"""
+Models of the energy layer switching time of a machine, as a function of the energies of the two layers.
+
+A model has a method times(from_energies, to_energies) that returns the switching times of all pairs at once, as an
+array. switch_times() applies a model to the layers of a beam, where consecutive layers of the same energy have no
+switching time.
+
+A lookup table is stored as a CSV file, where the first row has the energies that are switched to, the first column the
+energies that are switched from, and the rest the switching times in seconds, e.g.
+	,70.0,100.0,150.0
+	70.0,0.0,2.0,4.0
+	100.0,0.6,0.0,3.0
+	150.0,0.8,0.7,0.0
+"""
+import numpy as np
+
+
+class ConstantSwitchTime():
+	def __init__(self, time):
+		assert time >= 0
+		self.time = float(time)
+
+	def times(self, from_energies, to_energies):
+		return np.full(np.shape(from_energies), self.time)
+
+
+class UpDownSwitchTime():
+	# One switching time up in energy and one down, as in ATOM_from_RS.py.
+	def __init__(self, up, down):
+		assert up >= 0 and down >= 0
+		self.up = float(up)
+		self.down = float(down)
+
+	def times(self, from_energies, to_energies):
+		return np.where(np.asarray(to_energies) > np.asarray(from_energies), self.up, self.down)
+
+
+class LookupSwitchTime():
+	"""
+	table[i, j] is the switching time from energies[i] to energies[j], for increasing energies. In between, the times
+	are interpolated bilinearly (method "linear") or taken from the nearest energies (method "nearest"). Energies
+	outside the table take the times at its boundary.
+	"""
+	def __init__(self, energies, table, method="linear"):
+		assert method in ("linear", "nearest"), "Unknown method " + str(method)
+		self.energies = np.asarray(energies, dtype=float)
+		self.table = np.asarray(table, dtype=float)
+		assert len(self.energies) > 1 and np.all(np.diff(self.energies) > 0)
+		assert self.table.shape == (len(self.energies), len(self.energies))
+		assert np.all(self.table >= 0)
+		self.method = method
+
+	def grid_position(self, energies):
+		# The index of the grid interval of every energy, and the position within it, from 0 to 1.
+		energies = np.asarray(energies, dtype=float)
+		i = np.clip(np.searchsorted(self.energies, energies) - 1, 0, len(self.energies) - 2)
+		fraction = np.clip((energies - self.energies[i]) / (self.energies[i + 1] - self.energies[i]), 0.0, 1.0)
+		if self.method == "nearest":
+			fraction = np.round(fraction)
+		return i, fraction
+
+	def times(self, from_energies, to_energies):
+		i, s = self.grid_position(from_energies)
+		j, t = self.grid_position(to_energies)
+		table = self.table
+		return (1 - s) * (1 - t) * table[i, j] + s * (1 - t) * table[i + 1, j] + (1 - s) * t * table[i, j + 1] + s * t * table[i + 1, j + 1]
+
+
+class CallableSwitchTime():
+	"""
+	The switching times of a function(from_energy, to_energy). Beams only have a few distinct energies, so the function
+	is called once per distinct pair of energies, and the results are kept for later beams.
+	"""
+	def __init__(self, function):
+		self.function = function
+		self.known = {}
+
+	def times(self, from_energies, to_energies):
+		pairs = np.stack((np.ravel(from_energies), np.ravel(to_energies)), axis=1).astype(float)
+		if len(pairs) == 0:
+			return np.zeros(np.shape(from_energies))
+		unique_pairs, inverse = np.unique(pairs, axis=0, return_inverse=True)
+		for pair in map(tuple, unique_pairs.tolist()):
+			if pair not in self.known:
+				self.known[pair] = float(self.function(*pair))
+		unique_times = np.array([self.known[pair] for pair in map(tuple, unique_pairs.tolist())])
+		return unique_times[np.ravel(inverse)].reshape(np.shape(from_energies))
+
+
+def load_switch_time_table(path, method="linear"):
+	# A LookupSwitchTime from a CSV file, see above.
+	data = np.genfromtxt(path, delimiter=",", dtype=float)
+	return LookupSwitchTime(data[1:, 0], data[1:, 1:], method)
+
+
+def quantize(times, quantum):
+	# Rounds up to multiples of quantum, so that the delivery time is not underestimated.
+	steps = np.ceil(np.asarray(times) / quantum - 1.0e-9)
+	return np.round(steps * quantum, 12)
+
+
+def switch_times(energies, model, quantum=None):
+	"""
+	The switching times between the consecutive layers with the energies, by the model. With quantum, they are rounded
+	up to multiples of it, which leaves few distinct switching times for energy dependent models, so that a
+	precomputed ATOM_cost_table.EdgeCostTable, which has one slice per switching time, can cover them.
+	"""
+	energies = np.asarray(energies, dtype=float)
+	times = np.where(np.abs(np.diff(energies)) < 1.0e-8, 0.0, model.times(energies[:-1], energies[1:]))
+	if quantum is not None:
+		assert quantum > 0
+		times = quantize(times, quantum)
+	return times
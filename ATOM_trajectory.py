@@ -0,0 +1,145 @@
+"""
+The gantry trajectory of an ATOM solution, reconstructed from the velocities of the energy layers.
+"""
+from math import floor, sqrt
+
+import numpy as np
+
+from ATOM_costs import TransitionSolver, make_solver
+
+
+class AccelerationLimitedProfile():
+	"""
+	The movement between two windows that AccelerationLimitedSolver gives the duration of: change the velocity from v0
+	to a cruise velocity w with a_max or a_min, cruise, and change it to v1. w is the highest velocity for which the
+	movement takes the given duration.
+	"""
+	def __init__(self, v0, v1, remaining_angle, duration, parameters, iterations=100):
+		self.v0 = v0
+		self.v1 = v1
+		self.a_max = parameters["a_max"]
+		self.b_max = -parameters["a_min"]
+		a = self.a_max
+		b = self.b_max
+		peak = sqrt(max((2 * a * b * remaining_angle + b * v0 * v0 + a * v1 * v1) / (a + b), 0.0))
+		hi = min(peak, parameters["v_max"])
+		if self.phases(hi, remaining_angle)[3] >= duration:
+			w = hi
+		else:
+			# The duration decreases with w, so bisect for the w that is just fast enough.
+			lo = 0.0
+			for _ in range(iterations):
+				mid = (lo + hi) / 2
+				if self.phases(mid, remaining_angle)[3] > duration:
+					lo = mid
+				else:
+					hi = mid
+			w = hi
+		self.w = w
+		self.t1, _, self.t3, _ = self.phases(w, remaining_angle)
+		# What the bisection leaves of the duration is added to the cruise, so that the movement ends on time.
+		self.t_cruise = max(duration - self.t1 - self.t3, 0.0)
+		self.acc1 = self.a_max if w >= v0 else -self.b_max
+		self.acc3 = self.a_max if v1 >= w else -self.b_max
+
+	def phases(self, w, remaining_angle):
+		# Durations of the first velocity change, the cruise and the last velocity change, and their sum.
+		t1 = (w - self.v0) / self.a_max if w >= self.v0 else (self.v0 - w) / self.b_max
+		t3 = (self.v1 - w) / self.a_max if self.v1 >= w else (w - self.v1) / self.b_max
+		cruise_dist = remaining_angle - (w + self.v0) / 2 * t1 - (w + self.v1) / 2 * t3
+		t_cruise = 0.0 if cruise_dist <= 0 else (float('inf') if w <= 0 else cruise_dist / w)
+		return t1, t_cruise, t3, t1 + t_cruise + t3
+
+	def at_time(self, t):
+		# (position, velocity, acceleration) at time t after the start of the movement.
+		if t < self.t1:
+			return self.v0 * t + self.acc1 * t * t / 2, self.v0 + self.acc1 * t, self.acc1
+		x = self.v0 * self.t1 + self.acc1 * self.t1 * self.t1 / 2
+		t -= self.t1
+		if t < self.t_cruise:
+			return x + self.w * t, self.w, 0.0
+		x += self.w * self.t_cruise
+		t = min(t - self.t_cruise, self.t3)
+		return x + self.w * t + self.acc3 * t * t / 2, self.w + self.acc3 * t, self.acc3 if t < self.t3 else 0.0
+
+
+class RuckigProfile():
+	# The movement between two windows that TransitionSolver gives the duration of.
+	def __init__(self, v0, v1, remaining_angle, elst, parameters):
+		solver = TransitionSolver(parameters)
+		solver.duration(v0, v1, remaining_angle, elst)
+		self.trajectory = solver.trajectory
+
+	def at_time(self, t):
+		position, velocity, acceleration = self.trajectory.at_time(t)
+		return position[0], velocity[0], acceleration[0]
+
+
+class ArcTrajectory():
+	"""
+	The delivery of an arc, given the velocity of every energy layer.
+
+	Layer i is irradiated from irradiation_starts[i] to irradiation_ends[i], at constant velocity vels[i], while the
+	gantry goes from window_starts[i] to window_ends[i]. The angles are relative to the middle of the first window. After
+	the irradiation, the gantry moves to the next window in segment_durations[i] seconds, of which dead_times[i] is the
+	time beyond the energy layer switching time.
+
+	The movements are not stored, sample() recomputes them one segment at a time.
+	"""
+	def __init__(self, irr_times, elsts, angle_distances, parameters, vels):
+		n = len(irr_times)
+		assert len(vels) == n
+		self.irr_times = np.asarray(irr_times, dtype=float)
+		self.elsts = np.asarray(elsts, dtype=float)
+		self.parameters = parameters
+		self.vels = np.asarray(vels, dtype=float)
+
+		centers = np.concatenate(([0.0], np.cumsum(angle_distances)))
+		window_sizes = self.vels * self.irr_times
+		self.window_starts = centers - window_sizes / 2
+		self.window_ends = centers + window_sizes / 2
+		# The same rounding as in EdgeCostEngine.cost, such that the durations are the edge costs of the search.
+		self.remaining_angles = np.asarray(angle_distances, dtype=float) - (window_sizes[:-1] + window_sizes[1:]) / 2
+
+		solver = make_solver(parameters)
+		self.segment_durations = np.array([solver.duration(self.vels[i], self.vels[i + 1], self.remaining_angles[i], self.elsts[i]) for i in range(n - 1)])
+		assert np.all(np.isfinite(self.segment_durations)), "The velocities are not feasible"
+		self.dead_times = self.segment_durations - self.elsts
+
+		self.irradiation_starts = np.concatenate(([0.0], np.cumsum(self.irr_times[:-1] + self.segment_durations)))
+		self.irradiation_ends = self.irradiation_starts + self.irr_times
+		self.delivery_time = float(self.irradiation_ends[-1])
+
+	def segment_profile(self, i):
+		# An object with at_time(t), for the movement after layer i.
+		if self.parameters["j_max"] == float('inf'):
+			return AccelerationLimitedProfile(self.vels[i], self.vels[i + 1], self.remaining_angles[i], self.segment_durations[i], self.parameters)
+		return RuckigProfile(self.vels[i], self.vels[i + 1], self.remaining_angles[i], self.elsts[i], self.parameters)
+
+	def sample(self, rate):
+		"""
+		Generates (time, angle, velocity, acceleration) at rate samples per second, from 0 to the delivery time. Only one
+		movement is kept at a time, so that long arcs can be streamed.
+		"""
+		assert rate > 0
+		n = len(self.irr_times)
+		k = 0
+		for i in range(n):
+			start = self.irradiation_starts[i]
+			end = self.irradiation_ends[i]
+			while k / rate < end or (i + 1 == n and k / rate <= end):
+				t = k / rate
+				yield t, self.window_starts[i] + self.vels[i] * (t - start), self.vels[i], 0.0
+				k += 1
+			if i + 1 == n:
+				break
+			profile = self.segment_profile(i)
+			segment_end = self.irradiation_starts[i + 1]
+			while k / rate < segment_end:
+				t = k / rate
+				position, velocity, acceleration = profile.at_time(t - end)
+				yield t, self.window_ends[i] + position, velocity, acceleration
+				k += 1
+
+	def num_samples(self, rate):
+		return floor(self.delivery_time * rate) + 1
@@ -14,26 +14,27 @@ def obj_rucking(xs, vels, EL_switches, irr_times):
 	t = 0.0
 	#ts = [t]
 	#min_durs = 0
-	for i in range(1, len(xs)):
-		otg = Ruckig(1)
-		inp = InputParameter(1)
-		trajectory = Trajectory(1)
+	# The Ruckig objects and the limits are shared by all segments.
+	otg = Ruckig(1)
+	inp = InputParameter(1)
+	trajectory = Trajectory(1)
 
-		inp.current_position = [0]
+	inp.current_position = [0]
+	inp.current_acceleration = [0.0]
+	inp.target_acceleration = [0.0]
+
+	inp.max_velocity = [5.0]
+	inp.max_acceleration = [0.5]
+	inp.max_jerk = [0.5]
+
+	inp.min_velocity = [-1.0e-16]
+	inp.min_acceleration = [-0.5]
+	for i in range(1, len(xs)):
 		inp.current_velocity = [vels[i-1]]
-		inp.current_acceleration = [0.0]
 
 		inp.target_position = [2.0-(xs[i]+xs[i-1])/2]
 		# print(2-(xs[i]+xs[i-1])/2)
 		inp.target_velocity = [vels[i]]
-		inp.target_acceleration = [0.0]
-
-		inp.max_velocity = [5.0]
-		inp.max_acceleration = [0.5]
-		inp.max_jerk = [0.5]
-
-		inp.min_velocity = [-1.0e-16]
-		inp.min_acceleration = [-0.5]
 
 		idx = i - 1
 
@@ -98,11 +99,18 @@ if __name__ == '__main__':
 		t = 0.0
 		#ts = [t]
 		#min_durs = 0
-		for i in range(1, len(xs)):
-			otg = Ruckig(1)
-			inp = InputParameter(1)
-			trajectory = Trajectory(1)
+		# The Ruckig objects and the limits are shared by all segments.
+		otg = Ruckig(1)
+		inp = InputParameter(1)
+		trajectory = Trajectory(1)
 
+		inp.max_velocity = [5.0]
+		inp.max_acceleration = [0.5]
+		inp.max_jerk = [0.5]
+
+		inp.min_velocity = [-1.0e-16]
+		inp.min_acceleration = [-0.5]
+		for i in range(1, len(xs)):
 			inp.current_position = [xs[i-1]]
 			inp.current_velocity = [vels[i-1]]
 			inp.current_acceleration = [accs[i-1]]
@@ -111,13 +119,6 @@ if __name__ == '__main__':
 			inp.target_velocity = [vels[i]]
 			inp.target_acceleration = [accs[i]]
 
-			inp.max_velocity = [5.0]
-			inp.max_acceleration = [0.5]
-			inp.max_jerk = [0.5]
-
-			inp.min_velocity = [-1.0e-16]
-			inp.min_acceleration = [-0.5]
-
 			idx = i - 1
 
 			# print(idx, len(EL_switches), len(irr_times), len(xs))
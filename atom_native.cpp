@@ -0,0 +1,227 @@
+// Compiled A* backend for atom() in ATOM.py, with the same search and edge costs as solve_astar() there, and the
+// "switching" heuristic of ATOM.cpp. Unlike ATOM.cpp, the velocity resolution is a run time argument, and the gantry
+// does not move backwards (min_velocity = 0), like in the Python implementation.
+//
+// Build (see readme.md):
+// c++ -O3 -shared -std=c++17 -fPIC $(python3 -m pybind11 --includes) atom_native.cpp -lruckig -o atom_native$(python3-config --extension-suffix)
+#include <pybind11/pybind11.h>
+#include <pybind11/stl.h>
+#include <ruckig/ruckig.hpp>
+
+#include <algorithm>
+#include <cmath>
+#include <cstdint>
+#include <functional>
+#include <limits>
+#include <queue>
+#include <stdexcept>
+#include <tuple>
+#include <vector>
+
+namespace py = pybind11;
+using namespace ruckig;
+
+namespace {
+const double INF = std::numeric_limits<double>::infinity();
+
+class EdgeCosts {
+  public:
+	EdgeCosts(
+	    const std::vector<double>& irrTimes_,
+	    const std::vector<double>& elsts_,
+	    const std::vector<double>& angleDistances_,
+	    double maximumWindowSize_,
+	    double vMax,
+	    double aMax,
+	    double aMin,
+	    double jMax) :
+		irrTimes(irrTimes_),
+		elsts(elsts_),
+		angleDistances(angleDistances_),
+		maximumWindowSize(maximumWindowSize_),
+		solverCalls(0u),
+		infeasible(0u)
+	{
+		input.current_position = { 0.0 };
+		input.current_acceleration = { 0.0 };
+		input.target_acceleration = { 0.0 };
+
+		input.max_velocity = { vMax };
+		input.max_acceleration = { aMax };
+		input.max_jerk = { jMax };
+
+		input.min_velocity = { -1.0e-16 };  // As in ATOM_costs.TransitionSolver.
+		input.min_acceleration = { aMin };
+	}
+
+	// The cost of the edge from velocity v0 in layer idx - 1 to velocity v1 in layer idx, see ATOM_costs.EdgeCostEngine.
+	double cost(size_t idx, double v0, double v1) {
+		const size_t idx0 = idx - 1;
+		const double windowSize0 = v0 * irrTimes[idx0];
+		const double windowSize1 = v1 * irrTimes[idx];
+		if (windowSize0 > maximumWindowSize || windowSize1 > maximumWindowSize) {
+			return INF;
+		}
+
+		input.current_velocity = { v0 };
+		input.target_velocity = { v1 };
+		input.target_position = { angleDistances[idx0] - (windowSize0 + windowSize1) / 2 };
+		input.minimum_duration = elsts[idx0];
+
+		++solverCalls;
+		const Result result = otg.calculate(input, trajectory);
+		if (result != Result::Working) {
+			++infeasible;
+			return INF;
+		}
+		return trajectory.get_duration() + irrTimes[idx0];
+	}
+
+	const std::vector<double>& irrTimes;
+	const std::vector<double>& elsts;
+	const std::vector<double>& angleDistances;
+	const double maximumWindowSize;
+	size_t solverCalls;
+	size_t infeasible;
+
+  private:
+	Ruckig<1> otg;
+	InputParameter<1> input;
+	Trajectory<1> trajectory;
+};
+
+// Same as ATOM.linspace and ATOM.window_limited_vel_idx, such that the layers contain exactly the same states.
+std::vector<double> getDiscVels(double vMax, size_t velRes) {
+	std::vector<double> discVels(velRes);
+	const double delta = vMax / (velRes - 1);
+	for (size_t i = 0; i < velRes; ++i) {
+		discVels[i] = i * delta;
+	}
+	return discVels;
+}
+
+size_t windowLimitedVelIdx(const std::vector<double>& discVels, double irrTime, double maxWindow) {
+	if (irrTime <= 0) {
+		return discVels.size();
+	}
+	size_t end = 0;
+	while (end < discVels.size() && discVels[end] * irrTime <= maxWindow) {
+		++end;
+	}
+	return end;
+}
+}
+
+// Returns (delivery time, velocity indices of the layers, expanded states, evaluated edges, solver calls, infeasible
+// edges). The delivery time is infinite, and the indices empty, if there is no feasible trajectory.
+py::tuple solveAstar(
+    const std::vector<double>& irrTimes,
+    const std::vector<double>& elsts,
+    const std::vector<double>& angleDistances,
+    double maximumWindowSize,
+    double vMax,
+    double aMax,
+    double aMin,
+    double jMax,
+    size_t velRes) {
+	const size_t n = irrTimes.size();
+	if (n < 2 || elsts.size() != n - 1 || angleDistances.size() != n - 1 || velRes < 2) {
+		throw std::invalid_argument("atom_native.solve_astar: inconsistent input sizes");
+	}
+	const auto discVels = getDiscVels(vMax, velRes);
+	EdgeCosts edgeCosts(irrTimes, elsts, angleDistances, maximumWindowSize, vMax, aMax, aMin, jMax);
+
+	std::vector<size_t> velIdxEnd(n, 1u);
+	for (size_t angIdx = 1; angIdx + 1 < n; ++angIdx) {
+		velIdxEnd[angIdx] = windowLimitedVelIdx(discVels, irrTimes[angIdx], maximumWindowSize);
+	}
+
+	// The remaining irradiation and switching times, summed in the same order as ATOM.astar_heuristic.
+	std::vector<double> heuristic(n, 0.0);
+	for (size_t i = n - 1; i-- > 0;) {
+		heuristic[i] = heuristic[i + 1] + (irrTimes[i] + elsts[i]);
+	}
+
+	const size_t numCells = n * velRes;
+	const size_t finalCell = (n - 1) * velRes;
+	std::vector<double> gScore(numCells, INF);
+	std::vector<double> fScore(numCells, INF);
+	std::vector<int64_t> cameFrom(numCells, -1);
+	std::vector<bool> hasBeenVisited(numCells, false);
+
+	// Entries are (f, -v_idx, -cell), with lazy deletion, as in ATOM.push_open, so that ties are broken the same way.
+	using Entry = std::tuple<double, int64_t, int64_t>;
+	std::priority_queue<Entry, std::vector<Entry>, std::greater<Entry>> openHeap;
+	gScore[0] = 0.0;
+	fScore[0] = heuristic[0];
+	openHeap.emplace(fScore[0], 0, 0);
+
+	size_t expanded = 0;
+	size_t edges = 0;
+	int64_t current = -1;
+	while (!openHeap.empty()) {
+		const auto top = openHeap.top();
+		openHeap.pop();
+		const int64_t cell = -std::get<2>(top);
+		if (hasBeenVisited[cell] || std::get<0>(top) != fScore[cell]) {
+			continue;
+		}
+		hasBeenVisited[cell] = true;
+		if (static_cast<size_t>(cell) == finalCell) {
+			current = cell;
+			break;
+		}
+		++expanded;
+
+		const size_t angIdx = cell / velRes;
+		const size_t vIdx = cell % velRes;
+		const double v = discVels[vIdx];
+		const double currentGScore = gScore[cell];
+
+		// Same as SearchProblem.neigh_vel_range.
+		const double halfWindow = v * irrTimes[angIdx] * 0.5;
+		const double distance = angleDistances[angIdx] - halfWindow;
+		const double localMaxVel = std::sqrt(2 * aMax * distance + v * v);
+		const double minSquare = 2 * aMin * distance + v * v;
+		const double localMinVel = minSquare < 0 ? 0.0 : std::sqrt(minSquare);
+		const size_t neighAngIdx = angIdx + 1;
+		const size_t lo = std::lower_bound(discVels.begin(), discVels.end(), localMinVel) - discVels.begin();
+		const size_t hi = std::min(static_cast<size_t>(std::upper_bound(discVels.begin(), discVels.end(), localMaxVel) - discVels.begin()), velIdxEnd[neighAngIdx]);
+
+		const size_t firstNeighCell = neighAngIdx * velRes;
+		for (size_t neighVIdx = lo; neighVIdx < hi; ++neighVIdx) {
+			const size_t neigh = firstNeighCell + neighVIdx;
+			if (hasBeenVisited[neigh]) {
+				continue;
+			}
+			++edges;
+			const double d = edgeCosts.cost(neighAngIdx, v, discVels[neighVIdx]);
+			if (d == INF) {
+				continue;
+			}
+			const double tentativeGScore = currentGScore + d;
+			if (tentativeGScore <= gScore[neigh]) {
+				cameFrom[neigh] = cell;
+				gScore[neigh] = tentativeGScore;
+				fScore[neigh] = tentativeGScore + heuristic[neighAngIdx];
+				openHeap.emplace(fScore[neigh], -static_cast<int64_t>(neighVIdx), -static_cast<int64_t>(neigh));
+			}
+		}
+	}
+
+	std::vector<size_t> vIdxs;
+	double timeVal = INF;
+	if (current != -1) {
+		timeVal = gScore[current] + irrTimes.back();
+		for (; current != -1; current = cameFrom[current]) {
+			vIdxs.push_back(current % velRes);
+		}
+		std::reverse(vIdxs.begin(), vIdxs.end());
+	}
+	return py::make_tuple(timeVal, vIdxs, expanded, edges, edgeCosts.solverCalls, edgeCosts.infeasible);
+}
+
+PYBIND11_MODULE(atom_native, m) {
+	m.doc() = "Compiled A* backend of ATOM, see atom_native.cpp.";
+	m.def("solve_astar", &solveAstar, py::arg("irr_times"), py::arg("elsts"), py::arg("angle_distances"), py::arg("maximum_window_size"), py::arg("v_max"), py::arg("a_max"), py::arg("a_min"), py::arg("j_max"), py::arg("vel_res"));
+}
@@ -0,0 +1,364 @@
+"""
+Benchmark of the Python ATOM implementation.
+
+The workload mimics the one in main() of ATOM.cpp: equally spaced layers, uniformly distributed irradiation times
+and 10 % up-switches in energy.
+
+Usage: python benchmark.py [--n 60] [--vel-res 64] [--runs 3] [--method astar] [--heuristic relaxed]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import ATOM
+import ATOM_costs
+from ATOM_cost_table import load_cost_table
+from ATOM_estimate import atom_estimate, path_delivery_time
+from ATOM_incremental import IncrementalATOM
+from ATOM_preprocess import beam_arcs, beam_from_arrays
+from ATOM_switch_times import UpDownSwitchTime
+
+
+def random_workload(n, seed, elst_down=0.5, elst_up=5.0, up_switch_prob=0.1, angle_distance=2.0, max_irr_time=1.26):
+	rng = random.Random(seed)
+	irr_times = [rng.uniform(0.0, max_irr_time) for _ in range(n)]
+	elsts = [elst_up if rng.random() < up_switch_prob else elst_down for _ in range(n - 1)]
+	angle_distances = [angle_distance] * (n - 1)
+	maximum_window_size = 0.995 * angle_distance  # ATOM requires the windows to be strictly smaller than the spacing.
+	return irr_times, elsts, angle_distances, maximum_window_size
+
+
+def cpp_workloads(count, n=360, seed=0):
+	# The plans of main() in ATOM.cpp, drawn from the same random number stream: std::default_random_engine is a
+	# std::mt19937 with MSVC, and std::uniform_real_distribution takes two 32 bit numbers per double. This reproduces the
+	# static times (second column) in DataFromArticle. maxWindow is 2.0 there, which atom() does not allow, so the
+	# windows are a little smaller here.
+	generator = np.random.MT19937()
+	generator._legacy_seeding(seed)
+
+	def uniform(a, b):
+		low, high = (int(x) for x in generator.random_raw(2))
+		return a + (b - a) * ((low + high * 2.0 ** 32) / 2.0 ** 64)
+
+	for _ in range(count):
+		irr_times = [uniform(0.0, 1.26) for _ in range(n)]
+		elsts = [5.0 if uniform(0.0, 1.0) < 0.1 else 0.5 for _ in range(n - 1)]
+		yield irr_times, elsts, [2.0] * (n - 1), 0.995 * 2.0
+
+
+def check_acceleration_limited(parameters, samples, seed, tolerance=1.0e-4):
+	# Compares the closed form solver with Ruckig at a very high jerk limit on random transitions. The two should agree
+	# whenever the energy layer switching time is not binding, up to the jerk phases of about a_max / j_max = 5e-5 s.
+	# When it is, Ruckig 0.9.2 tends to jump to a much slower profile, so there the closed form result must only not be
+	# larger. Returns whether the check passed.
+	rng = random.Random(seed)
+	closed_form = ATOM_costs.AccelerationLimitedSolver(dict(parameters, j_max=float('inf')))
+	ruckig = ATOM_costs.TransitionSolver(dict(parameters, j_max=1.0e4))
+	worst_free = 0.0
+	worst_binding = float('-inf')
+	feasibility_mismatches = 0
+	for _ in range(samples):
+		v0 = rng.uniform(0.0, parameters["v_max"])
+		v1 = rng.uniform(0.0, parameters["v_max"])
+		remaining_angle = rng.uniform(0.01, 20.0)
+		elst = rng.choice([0.0, 0.5, 5.0, rng.uniform(0.0, 10.0)])
+		t_closed_form = closed_form.duration(v0, v1, remaining_angle, elst)
+		t_ruckig = ruckig.duration(v0, v1, remaining_angle, elst)
+		if (t_closed_form == float('inf')) != (t_ruckig == float('inf')):
+			feasibility_mismatches += 1
+		elif t_closed_form != float('inf'):
+			if elst <= closed_form.duration(v0, v1, remaining_angle, 0.0):
+				worst_free = max(worst_free, abs(t_closed_form - t_ruckig))
+			else:
+				worst_binding = max(worst_binding, t_closed_form - t_ruckig)
+	print("closed form vs Ruckig (j_max = 1e4) on %d transitions: %d feasibility mismatches, max |difference| %.2e s without binding switching time, max (closed form - Ruckig) %.2e s with" % (samples, feasibility_mismatches, worst_free, worst_binding))
+	passed = feasibility_mismatches == 0 and worst_free <= tolerance and worst_binding <= 1.0e-9
+	if not passed:
+		print("FAILED: the closed form solver does not agree with Ruckig within %.0e s" % tolerance)
+	return passed
+
+
+def check_cache(args, parameters, maxsize=50):
+	# A cache that is much smaller than the number of edges drops entries during the search, and has to miss on them
+	# later, with and without a database, without changing the result.
+	workload = random_workload(args.n, args.seed, elst_down=args.elst_down)
+	reference, _ = ATOM.atom(*workload, parameters, args.vel_res, backend="python")
+	for path in (None, ":memory:"):
+		with ATOM_costs.EdgeCostCache(maxsize=maxsize, path=path) as cache:
+			for _ in range(2):
+				delivery_time, _ = ATOM.atom(*workload, parameters, args.vel_res, cache=cache, backend="python")
+				assert delivery_time == reference, "The delivery time with a cache of %d entries differs: %r != %r" % (maxsize, delivery_time, reference)
+			assert cache.misses > maxsize and len(cache) == maxsize, "The cache did not drop entries"
+			print("cache of %d entries%s: %d hits, %d misses, same delivery time" % (maxsize, "" if path is None else " with a database", cache.hits, cache.misses))
+
+	# Two connections to one database file, as the processes of atom_batch() have, which both miss after dropping
+	# entries while the other one has entries that are not flushed yet. A connection that held a write lock would make
+	# the other one fail with "database is locked".
+	with tempfile.TemporaryDirectory() as directory:
+		path = os.path.join(directory, "cache.sqlite")
+		with ATOM_costs.EdgeCostCache(maxsize=maxsize, path=path) as first, ATOM_costs.EdgeCostCache(maxsize=maxsize, path=path) as second:
+			for cache in (first, second, first, second):
+				delivery_time, _ = ATOM.atom(*workload, parameters, args.vel_res, cache=cache, backend="python")
+				assert delivery_time == reference, "The delivery time with two caches on one file differs: %r != %r" % (delivery_time, reference)
+			print("two caches of %d entries on one database: %d and %d hits, same delivery time" % (maxsize, first.hits, second.hits))
+	return True
+
+
+def check_native(args, parameters, tolerance=1.0e-9):
+	# Parity of the compiled backend with the Python one. With the same heuristic, the searches break ties in the same
+	# way, so the velocities should agree as well, up to rounding in the edge costs. Returns whether the check passed.
+	if ATOM.atom_native is None:
+		print("native vs Python backend: skipped, the native backend is not built (see the readme)")
+		return True
+	worst_time = 0.0
+	worst_vel = 0.0
+	python_time = 0.0
+	native_time = 0.0
+	for run in range(args.check_native):
+		workload = random_workload(args.n, args.seed + run, elst_down=args.elst_down)
+		t0 = time.perf_counter()
+		native = ATOM.atom(*workload, parameters, args.vel_res, backend="native")
+		t1 = time.perf_counter()
+		python = ATOM.atom(*workload, parameters, args.vel_res, heuristic="switching", backend="python")
+		t2 = time.perf_counter()
+		native_time += t1 - t0
+		python_time += t2 - t1
+		if native[0] != python[0]:
+			worst_time = max(worst_time, abs(native[0] - python[0]) / python[0] if python[0] != float('inf') else float('inf'))
+		if (native[1] is None) != (python[1] is None) or len(native[1] or []) != len(python[1] or []):
+			worst_vel = float('inf')
+		elif native[1] is not None:
+			worst_vel = max(worst_vel, max(abs(a - b) for a, b in zip(native[1], python[1])))
+	print("native vs Python backend on %d plans: max relative delivery time difference %.2e, max velocity difference %.2e, %.3f s vs %.3f s per plan" % (args.check_native, worst_time, worst_vel, native_time / args.check_native, python_time / args.check_native))
+	passed = worst_time <= tolerance and worst_vel <= tolerance
+	if not passed:
+		print("FAILED: the backends differ by more than %.0e" % tolerance)
+	return passed
+
+
+def check_estimate(args, parameters, layers=5, step=1.0e-3, tolerance=1.0e-6):
+	# Agreement of atom_estimate with atom() on the plans of main(), and of its gradients with central differences of
+	# the delivery time of the estimated velocities on the first plan. The estimate has to be an upper bound and the
+	# lower bound a lower one. Returns whether the check passed.
+	estimate_time = 0.0
+	exact_time = 0.0
+	errors = []
+	bounded = True
+	for run in range(args.check_estimate):
+		workload = random_workload(args.n, args.seed + run, elst_down=args.elst_down)
+		t0 = time.perf_counter()
+		exact, _ = ATOM.atom(*workload, parameters, args.vel_res, backend=args.backend)
+		exact_time += time.perf_counter() - t0
+		estimate = atom_estimate(*workload, parameters, args.vel_res, args.stride)
+		estimate_time += estimate.seconds
+		errors.append(estimate.delivery_time / exact - 1)
+		bounded &= estimate.lower_bound <= exact * (1 + 1.0e-9) <= estimate.delivery_time * (1 + 2.0e-9)
+		print("plan %d: atom %.3f s, estimate %.3f s (%+.2f %%), %s lower bound %.3f s (%+.2f %%, gap %.3f s)" % (run, exact, estimate.delivery_time, 100 * errors[-1], estimate.bound, estimate.lower_bound, 100 * (estimate.lower_bound / exact - 1), estimate.gap))
+	print("estimate: mean error %+.2f %%, max %+.2f %%, %.3f s vs %.3f s per plan" % (100 * np.mean(errors), 100 * np.max(errors), estimate_time / args.check_estimate, exact_time / args.check_estimate))
+
+	irr_times, elsts, angle_distances, maximum_window_size = random_workload(args.n, args.seed, elst_down=args.elst_down)
+	estimate = atom_estimate(irr_times, elsts, angle_distances, maximum_window_size, parameters, args.vel_res, args.stride, lower_bound=False)
+	worst = 0.0
+	for k in random.Random(args.seed).sample(range(args.n), layers):
+		differences = []
+		for sign in (1, -1):
+			perturbed = list(irr_times)
+			perturbed[k] += sign * step
+			edge_costs = ATOM_costs.EdgeCostEngine(perturbed, elsts, angle_distances, maximum_window_size, parameters)
+			differences.append(path_delivery_time(edge_costs, perturbed, estimate.vels))
+		worst = max(worst, abs((differences[0] - differences[1]) / (2 * step) - estimate.d_irr_times[k]))
+	print("gradient: max difference to central differences over %d irradiation times %.2e" % (layers, worst))
+	passed = bounded and worst <= tolerance
+	if not passed:
+		print("FAILED: the bounds do not enclose atom(), or the gradients differ by more than %.0e" % tolerance)
+	return passed
+
+
+def reference_arcs(beam, spot_delivery_s_per_mu, time_per_spot_switch, up, down):
+	# The inputs of the arcs of a beam with one loop per layer, as ATOM_from_RS.py computed them before ATOM_preprocess.py.
+	segments = list(beam.Segments)
+	n = len(segments)
+	energies = [segment.NominalEnergy for segment in segments]
+	elsts = [0.0 if abs(energies[i + 1] - energies[i]) < 1.0e-8 else (up if energies[i + 1] > energies[i] else down) for i in range(n - 1)]
+	irr_times = [spot_delivery_s_per_mu * sum(beam.BeamMU * w for w in segment.Spots.Weights) + time_per_spot_switch * max(len(segment.Spots.Weights) - 1, 0) for segment in segments]
+	angles = [segment.IonArcSegmentProperties.DeltaGantryAngle % 360.0 for segment in segments]
+	distances = [min(abs(angles[i + 1] - angles[i]), 360.0 - abs(angles[i + 1] - angles[i])) for i in range(n - 1)]
+	directions = [str(segment.IonArcSegmentProperties.RotationDirection) for segment in segments]
+	starts = [0] + [i for i in range(1, n - 1) if directions[i] != directions[i - 1]]
+	ends = starts[1:] + [n]
+	return [(irr_times[start:end], elsts[start:end - 1], distances[start:end - 1], 0.0 if end == n else elsts[end - 1]) for start, end in zip(starts, ends)]
+
+
+def check_preprocess(args, beams, tolerance=1.0e-9):
+	# ATOM_preprocess.beam_arcs against reference_arcs() on random beams. Returns whether the check passed.
+	rng = random.Random(args.seed)
+	spot_delivery_s_per_mu, time_per_spot_switch, up, down = 0.005, 0.002, 5.0, 0.5
+	worst = 0.0
+	mismatches = 0
+	for _ in range(beams):
+		n = rng.randint(4, 60)
+		directions = []
+		direction = "Clockwise"
+		for _ in range(n):
+			if rng.random() < 0.05:
+				direction = "CounterClockwise" if direction == "Clockwise" else "Clockwise"
+			directions.append(direction)
+		start = rng.uniform(-400.0, 400.0)
+		angles = [start + 2.0 * i for i in range(n)]
+		energies = [rng.choice([70.0, 80.0, 90.0, 100.0]) for _ in range(n)]
+		weights = [[rng.random() for _ in range(rng.choice([0, 1, rng.randint(2, 20)]))] for _ in range(n)]
+		beam = beam_from_arrays(rng.uniform(10.0, 500.0), energies, angles, directions, weights)
+		arcs = beam_arcs(beam, spot_delivery_s_per_mu, time_per_spot_switch, UpDownSwitchTime(up, down))
+		reference = reference_arcs(beam, spot_delivery_s_per_mu, time_per_spot_switch, up, down)
+		if len(arcs) != len(reference) or any(len(arc.irr_times) != len(expected[0]) or arc.elsts != expected[1] or arc.elst_after != expected[3] for arc, expected in zip(arcs, reference)):
+			mismatches += 1
+			continue
+		for arc, expected in zip(arcs, reference):
+			worst = max([worst] + [abs(a - b) for a, b in zip(arc.irr_times, expected[0])] + [abs(a - b) for a, b in zip(arc.angle_distances, expected[2])])
+	print("preprocessing vs per layer loops on %d beams: %d arc or switching time mismatches, max difference %.2e" % (beams, mismatches, worst))
+	passed = mismatches == 0 and worst <= tolerance
+	if not passed:
+		print("FAILED: ATOM_preprocess differs from the per layer loops")
+	return passed
+
+
+def check_all(args, parameters):
+	# All of the checks, with small sizes, for use as the test suite. Returns whether they all passed.
+	args = argparse.Namespace(**dict(vars(args), check_native=args.check_native or 3, check_estimate=args.check_estimate or 2))
+	results = [
+		check_acceleration_limited(parameters, 2000, args.seed),
+		check_cache(args, parameters),
+		check_native(args, parameters),
+		check_estimate(args, parameters),
+		check_preprocess(args, 200)]
+	print("%d of %d checks passed" % (sum(results), len(results)))
+	return all(results)
+
+
+def benchmark_incremental(args, parameters):
+	# Changes the irradiation time of one random layer per step, as an optimisation loop would, and compares
+	# IncrementalATOM.update() with solving from scratch.
+	rng = random.Random(args.seed)
+	irr_times, elsts, angle_distances, maximum_window_size = random_workload(args.n, args.seed, elst_down=args.elst_down)
+	t0 = time.perf_counter()
+	incremental = IncrementalATOM(irr_times, elsts, angle_distances, maximum_window_size, parameters, args.vel_res)
+	incremental.solve()
+	print("initial incremental solve: %.3f s" % (time.perf_counter() - t0))
+	update_time = 0.0
+	full_time = 0.0
+	worst = 0.0
+	for _ in range(args.incremental):
+		irr_times = list(irr_times)
+		k = rng.randrange(args.n)
+		irr_times[k] *= rng.uniform(0.9, 1.1)
+		t0 = time.perf_counter()
+		delivery_time, _ = incremental.update(irr_times)
+		t1 = time.perf_counter()
+		reference, _ = ATOM.atom(irr_times, elsts, angle_distances, maximum_window_size, parameters, args.vel_res, method=args.method, heuristic=args.heuristic)
+		full_time += time.perf_counter() - t1
+		update_time += t1 - t0
+		worst = max(worst, abs(delivery_time - reference))
+	print("%d single layer changes: %.3f s per update, %.3f s per full solve, max difference %.2e s" % (args.incremental, update_time / args.incremental, full_time / args.incremental, worst))
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--n", type=int, default=60, help="Number of energy layers.")
+	parser.add_argument("--vel-res", type=int, default=64, help="Number of discrete velocities.")
+	parser.add_argument("--runs", type=int, default=3, help="Number of random plans.")
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--method", default="astar", choices=["astar", "bidirectional", "dp"], help="Search algorithm used by atom().")
+	parser.add_argument("--heuristic", default="relaxed", choices=["relaxed", "switching"], help="A* heuristic.")
+	parser.add_argument("--coarse-vel-res", type=int, help="Use atom_coarse_to_fine, starting at this resolution.")
+	parser.add_argument("--workers", type=int, help="Number of processes that compute the edge costs.")
+	parser.add_argument("--chunksize", type=int, default=1, help="Number of layer transitions per task for the worker processes.")
+	parser.add_argument("--elst-down", type=float, default=0.5, help="Energy layer switching time when going down in energy.")
+	parser.add_argument("--j-max", type=float, default=0.5, help="Maximum jerk, inf selects the acceleration limited model.")
+	parser.add_argument("--check-analytic", type=int, metavar="SAMPLES", help="Cross-check the closed form acceleration limited costs against Ruckig, and exit (with status 1 if they disagree).")
+	parser.add_argument("--time-budget", type=float, help="Use atom_anytime with this many seconds per plan, and print the lower bound.")
+	parser.add_argument("--weight", type=float, default=2.0, help="Heuristic weight of atom_anytime.")
+	parser.add_argument("--check-cache", action="store_true", help="Check that a small edge cost cache gives the same delivery time, and exit.")
+	parser.add_argument("--check-native", type=int, metavar="PLANS", help="Compare the compiled backend with the Python one on PLANS plans, and exit (with status 1 if they differ).")
+	parser.add_argument("--backend", default="python", choices=["auto", "python", "native"], help="Backend of atom().")
+	parser.add_argument("--check-estimate", type=int, metavar="PLANS", help="Compare atom_estimate with atom() on PLANS plans, and exit.")
+	parser.add_argument("--check-preprocess", type=int, metavar="BEAMS", help="Compare ATOM_preprocess with per layer loops on BEAMS random beams, and exit (with status 1 if they differ).")
+	parser.add_argument("--check-all", action="store_true", help="Run all of the checks with small sizes, and exit (with status 1 if any fails).")
+	parser.add_argument("--stride", type=int, default=3, help="Velocity grid stride of atom_estimate, has to divide vel_res - 1.")
+	parser.add_argument("--incremental", type=int, metavar="STEPS", help="Benchmark IncrementalATOM on STEPS single layer changes of one plan, and exit.")
+	parser.add_argument("--no-stats", action="store_true", help="Only measure the wall time, without SearchStats.")
+	parser.add_argument("--cost-table", help="Look the edge costs up in this table from ATOM_cost_table.py.")
+	parser.add_argument("--cost-table-mode", default="upper", choices=["upper", "linear"], help="Lookup of remaining angles in between the grid points.")
+	parser.add_argument("--cache-file", help="SQLite file for an edge cost cache that is shared by the runs (and by repeated invocations).")
+	args = parser.parse_args()
+
+	parameters = {"v_max": 5.0, "a_max": 0.5, "a_min": -0.5, "j_max": args.j_max}
+	if args.check_analytic is not None:
+		if not check_acceleration_limited(parameters, args.check_analytic, args.seed):
+			sys.exit(1)
+		return
+	if args.check_all:
+		if not check_all(args, parameters):
+			sys.exit(1)
+		return
+	if args.check_cache:
+		check_cache(args, parameters)
+		return
+	if args.check_native is not None:
+		if not check_native(args, parameters):
+			sys.exit(1)
+		return
+	if args.check_estimate is not None:
+		if not check_estimate(args, parameters):
+			sys.exit(1)
+		return
+	if args.check_preprocess is not None:
+		if not check_preprocess(args, args.check_preprocess):
+			sys.exit(1)
+		return
+	if args.incremental is not None:
+		benchmark_incremental(args, parameters)
+		return
+	cache = None if args.cache_file is None else ATOM_costs.EdgeCostCache(path=args.cache_file)
+	cost_table = None if args.cost_table is None else load_cost_table(args.cost_table, args.cost_table_mode)
+
+	total_time = 0.0
+	total_expansions = 0
+	for run in range(args.runs):
+		irr_times, elsts, angle_distances, maximum_window_size = random_workload(args.n, args.seed + run, elst_down=args.elst_down)
+		stats = None if args.no_stats else ATOM_costs.SearchStats()
+		t0 = time.perf_counter()
+		if args.time_budget is not None:
+			anytime = ATOM.atom_anytime(irr_times, elsts, angle_distances, maximum_window_size, parameters, args.vel_res, args.time_budget, weight=args.weight, cache=cache, heuristic=args.heuristic, stats=stats)
+			delivery_time = anytime.delivery_time
+			print("anytime: lower bound %.3f s, gap %.3f s, %s, %d improvements" % (anytime.lower_bound, anytime.gap, "optimal" if anytime.optimal else "stopped", len(anytime.incumbents)))
+		elif args.coarse_vel_res is None:
+			delivery_time, _ = ATOM.atom(irr_times, elsts, angle_distances, maximum_window_size, parameters, args.vel_res, cache=cache, method=args.method, workers=args.workers, chunksize=args.chunksize, heuristic=args.heuristic, stats=stats, backend=args.backend, cost_table=cost_table)
+		else:
+			refined = ATOM.atom_coarse_to_fine(irr_times, elsts, angle_distances, maximum_window_size, parameters, args.vel_res, args.coarse_vel_res, cache=cache, method=args.method, workers=args.workers, chunksize=args.chunksize, stats=stats)
+			delivery_time = refined.delivery_time
+			print("levels (vel_res, delivery time, seconds): %s, gap %.3f s" % (", ".join("(%d, %.3f, %.2f)" % level for level in refined.levels), refined.gap))
+		elapsed = time.perf_counter() - t0
+		total_time += elapsed
+		if stats is None:
+			print("run %d: delivery time %.3f s, %.3f s wall" % (run, delivery_time, elapsed))
+			continue
+		total_expansions += stats.expanded
+		print("run %d: delivery time %.3f s, %.3f s wall, %d expansions, %d edges, %d solver calls (%d infeasible, %d Ruckig failures), %.0f expansions/s" % (run, delivery_time, elapsed, stats.expanded, stats.edges_evaluated, stats.solver_calls, stats.infeasible_edges, stats.ruckig_failures, stats.expanded / elapsed))
+		print("       seconds per phase: %s" % ", ".join("%s %.3f" % item for item in stats.seconds.items()))
+
+	if args.no_stats:
+		print("mean: %.3f s wall" % (total_time / args.runs))
+	else:
+		print("mean: %.3f s wall, %.0f expansions/s" % (total_time / args.runs, total_expansions / total_time))
+	if cache is not None:
+		print("edge cost cache: %d hits, %d misses, %d entries" % (cache.hits, cache.misses, len(cache)))
+		cache.close()
+
+
+if __name__ == '__main__':
+	main()
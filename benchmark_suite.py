@@ -0,0 +1,137 @@
+"""
+Benchmark suite that regenerates the timing tables in DataFromArticle with the Python implementation.
+
+The plans are the ones from main() in ATOM.cpp (360 layers, see benchmark.cpp_workloads), solved for every combination
+of model ("jerk" limited, or "acc" limited with j_max = inf), number of layers and velocity resolution. For every case
+the wall time, expanded states, evaluated edges, Ruckig calls and peak memory (tracemalloc, measured in a separate run
+of the first plan) are recorded, next to the published running time and delivery times of the same plans where they
+exist. The results can be written as JSON and CSV, and compared with an earlier JSON file to track regressions.
+
+The plans are reproduced exactly (static_times_match), but the delivery times are not expected to agree with the
+published ones: ATOM.cpp lets the gantry move backwards (min_velocity = -v_max), and used another Ruckig version.
+
+Usage: python benchmark_suite.py [--vel-res 16 32 64] [--n 360] [--plans 3] [--json results.json] [--csv results.csv]
+       [--baseline earlier.json]
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import time
+import tracemalloc
+
+import ATOM
+import ATOM_costs
+from benchmark import cpp_workloads
+
+ARTICLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "DataFromArticle")
+PARAMETERS = {"v_max": 5.0, "a_max": 0.5, "a_min": -0.5, "j_max": 0.5}
+COLUMNS = ["model", "n", "vel_res", "method", "heuristic", "plans", "seconds_per_plan", "expansions_per_plan", "edges_per_plan", "ruckig_calls_per_plan", "peak_memory_mb", "mean_delivery_time", "published_seconds_per_plan", "published_mean_delivery_time", "max_delivery_time_difference", "static_times_match"]
+
+
+def published_results(vel_res, model, directory=ARTICLE_DIR):
+	"""
+	Reads DataFromArticle/<vel_res><model>.txt, which has one line "delivery time,static time" per plan and the total
+	running time of ATOM.cpp in the last line. Returns None if there is no such file.
+	"""
+	path = os.path.join(directory, "%d%s.txt" % (vel_res, model))
+	if not os.path.exists(path):
+		return None
+	with open(path) as f:
+		lines = [line for line in f.read().split("\n") if line]
+	delivery_times = [float(line.split(",")[0]) for line in lines[:-1]]
+	static_times = [float(line.split(",")[1]) for line in lines[:-1]]
+	total_ms = float(lines[-1].split("= ")[-1].replace("milliseconds.", ""))
+	return {"delivery_times": delivery_times, "static_times": static_times, "seconds_per_plan": total_ms / 1000 / len(delivery_times)}
+
+
+def run_case(model, n, vel_res, plans, method, heuristic):
+	parameters = dict(PARAMETERS, j_max=float('inf')) if model == "acc" else PARAMETERS
+	workloads = list(cpp_workloads(plans, n))
+
+	stats = ATOM_costs.SearchStats()
+	delivery_times = []
+	t0 = time.perf_counter()
+	for workload in workloads:
+		delivery_times.append(ATOM.atom(*workload, parameters, vel_res, method=method, heuristic=heuristic, stats=stats, backend="python")[0])
+	seconds = time.perf_counter() - t0
+
+	tracemalloc.start()
+	ATOM.atom(*workloads[0], parameters, vel_res, method=method, heuristic=heuristic, backend="python")
+	peak_memory = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+
+	row = {
+		"model": model, "n": n, "vel_res": vel_res, "method": method, "heuristic": heuristic, "plans": plans,
+		"seconds_per_plan": seconds / plans,
+		"expansions_per_plan": stats.expanded / plans,
+		"edges_per_plan": stats.edges_evaluated / plans,
+		"ruckig_calls_per_plan": stats.solver_calls / plans if model == "jerk" else 0,
+		"peak_memory_mb": peak_memory / 1.0e6,
+		"mean_delivery_time": sum(delivery_times) / plans,
+		"published_seconds_per_plan": None,
+		"published_mean_delivery_time": None,
+		"max_delivery_time_difference": None,
+		"static_times_match": None,
+	}
+	published = published_results(vel_res, model) if n == 360 else None
+	if published is not None and plans <= len(published["delivery_times"]):
+		published_times = published["delivery_times"][:plans]
+		row["published_seconds_per_plan"] = published["seconds_per_plan"]
+		row["published_mean_delivery_time"] = sum(published_times) / plans
+		row["max_delivery_time_difference"] = max(abs(a - b) for a, b in zip(delivery_times, published_times))
+		# The published static times (irradiation plus switching times) are rounded to 6 significant digits.
+		static_times = [sum(irr_times) + sum(elsts) for irr_times, elsts, _, _ in workloads]
+		row["static_times_match"] = all(abs(a - b) <= 1.0e-3 for a, b in zip(static_times, published["static_times"]))
+	return row
+
+
+def case_key(row):
+	return (row["model"], row["n"], row["vel_res"], row["method"], row["heuristic"])
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--vel-res", type=int, nargs="+", default=[16, 32, 64], help="Velocity resolutions to sweep.")
+	parser.add_argument("--n", type=int, nargs="+", default=[360], help="Numbers of energy layers to sweep.")
+	parser.add_argument("--plans", type=int, default=3, help="Number of plans per case (the article used 100).")
+	parser.add_argument("--models", nargs="+", default=["jerk", "acc"], choices=["jerk", "acc"])
+	parser.add_argument("--method", default="astar", choices=["astar", "bidirectional", "dp"])
+	parser.add_argument("--heuristic", default="relaxed", choices=["relaxed", "switching"])
+	parser.add_argument("--json", help="Write the results to this JSON file.")
+	parser.add_argument("--csv", help="Write the results to this CSV file.")
+	parser.add_argument("--baseline", help="JSON file of an earlier run to compare with.")
+	args = parser.parse_args()
+
+	rows = []
+	print("model     n  vel_res  s/plan  published s/plan  expansions     edges  memory MB  mean delivery  published  max diff")
+	for model in args.models:
+		for n in args.n:
+			for vel_res in args.vel_res:
+				row = run_case(model, n, vel_res, args.plans, args.method, args.heuristic)
+				rows.append(row)
+				published = ["-" if row[key] is None else "%.3f" % row[key] for key in ("published_seconds_per_plan", "published_mean_delivery_time", "max_delivery_time_difference")]
+				print("%-5s %5d %8d %7.3f %17s %11.0f %9.0f %10.1f %14.3f %10s %9s" % (model, n, vel_res, row["seconds_per_plan"], published[0], row["expansions_per_plan"], row["edges_per_plan"], row["peak_memory_mb"], row["mean_delivery_time"], published[1], published[2]))
+
+	if args.baseline is not None:
+		with open(args.baseline) as f:
+			baseline = {case_key(row): row for row in json.load(f)["rows"]}
+		for row in rows:
+			old = baseline.get(case_key(row))
+			if old is not None:
+				print("%s: %.2fx time, %.2fx expansions, %.2fx edges compared with the baseline" % ("/".join(str(k) for k in case_key(row)), row["seconds_per_plan"] / old["seconds_per_plan"], row["expansions_per_plan"] / max(old["expansions_per_plan"], 1), row["edges_per_plan"] / max(old["edges_per_plan"], 1)))
+
+	if args.json is not None:
+		metadata = {"python": platform.python_version(), "machine": platform.machine(), "processor": platform.processor(), "date": time.strftime("%Y-%m-%d %H:%M:%S")}
+		with open(args.json, "w") as f:
+			json.dump({"metadata": metadata, "rows": rows}, f, indent=1)
+	if args.csv is not None:
+		with open(args.csv, "w", newline="") as f:
+			writer = csv.DictWriter(f, fieldnames=COLUMNS)
+			writer.writeheader()
+			writer.writerows(rows)
+
+
+if __name__ == '__main__':
+	main()